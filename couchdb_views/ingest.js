@@ -0,0 +1,17 @@
+/*
+ * Views used by the enrich service while ingesting.
+ *
+ * original_record_hash is keyed by the id of the harvested record and gives
+ * the revision of its doc along with the hash of the record it was built
+ * from (null for docs stored without one), so records unchanged since the
+ * last ingest can be skipped and records deleted by the provider can be found.
+ */
+{
+    "_id": "_design/ingest",
+    "language": "javascript",
+    "views": {
+        "original_record_hash": {
+        "map": "function(doc) {\n  if (doc.ingestType == 'item' && doc.originalRecord) {\n    emit(doc.originalRecord.id, [doc._rev, doc.originalRecordHash || null]);\n  }\n}"
+        }
+    }
+}
@@ -10,7 +10,7 @@ import re
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 
 from dplaingestion import selector
 
@@ -10,7 +10,8 @@ import re
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion.batch import batch_service
+from dplaingestion import jsonio as json
 
 from dplaingestion import selector
 
@@ -19,7 +20,7 @@ HTTP_TYPE_JSON = 'application/json'
 HTTP_TYPE_TEXT = 'text/plain'
 HTTP_HEADER_TYPE = 'Content-Type'
 
-@simple_service('POST', 'http://purl.org/la/dp/artstor_select_isshownat', 'artstor_select_isshownat', HTTP_TYPE_JSON)
+@simple_service('POST', 'http://purl.org/la/dp/artstor_select_isshownat', 'artstor_select_isshownat', HTTP_TYPE_JSON, wsgi_wrapper=batch_service)
 def artstor_select_source(body, ctype):
 
     try:
@@ -1,11 +1,12 @@
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
 
 @simple_service('POST', 'http://purl.org/la/dp/contributor_to_collection',
-    'bhl_contributor_to_collection', 'application/json')
+    'bhl_contributor_to_collection', 'application/json', wsgi_wrapper=batch_service)
 def bhlcontributortocollection(body,ctype,contributor_field="aggregatedCHO/contributor"):
     """ Copies BHL contributor field value to collection field
     """
@@ -17,8 +18,8 @@ def bhlcontributortocollection(body,ctype,contributor_field="aggregatedCHO/contr
         response.add_header('content-type', 'text/plain')
         return "Unable to parse body as JSON"
 
-    if exists(data, contributor_field):
-        contributor = getprop(data, contributor_field)
+    contributor = getprop_or_default(data, contributor_field)
+    if contributor is not None:
         acronym = "".join(c[0] for c in contributor.split())
 
         setprop(data, "collection/@id", "http://dp.la/api/collections/bhl--"+acronym)
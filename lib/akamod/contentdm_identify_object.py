@@ -1,15 +1,16 @@
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
 from akara import module_config
 
 IGNORE = module_config().get('IGNORE')
 PENDING = module_config().get('PENDING')
 
 @simple_service('POST', 'http://purl.org/la/dp/contentdm_identify_object',
-    'contentdm_identify_object', 'application/json')
+    'contentdm_identify_object', 'application/json', wsgi_wrapper=batch_service)
 def contentdm_identify_object(body, ctype, rights_field="aggregatedCHO/rights", download="True"):
     """
     Responsible for: adding a field to a document with the URL where we
@@ -33,12 +34,12 @@ def contentdm_identify_object(body, ctype, rights_field="aggregatedCHO/rights",
         return msg
 
     handle_field = "originalRecord/handle"
-    if exists(data, handle_field):
-        url = getprop(data, handle_field)[1]
-    else:
+    handle = getprop_or_default(data, handle_field)
+    if handle is None:
         msg = "Field %s does not exist" % handle_field
         logger.error(msg)
         return body
+    url = handle[1]
 
     p = url.split("u?")
 
@@ -67,9 +68,7 @@ def contentdm_identify_object(body, ctype, rights_field="aggregatedCHO/rights",
         (base_url, p[0], p[1])
 
     # Gettings the rights field
-    rights = None
-    if exists(data, rights_field):
-        rights = getprop(data, rights_field)
+    rights = getprop_or_default(data, rights_field)
 
     data["object"] = {"@id": thumb_url, "format": "", "rights": rights}
 
@@ -1,4 +1,5 @@
-from amara.thirdparty import json, httplib2
+from amara.thirdparty import httplib2
+from dplaingestion import jsonio as json
 from amara.lib.iri import join
 from StringIO import StringIO
 from akara import module_config
@@ -11,8 +12,9 @@ import urllib
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion.batch import batch_service
 
 
 # The main directory where the images will be saved.
@@ -245,7 +247,7 @@ def set_error(data):
 
 
 @simple_service('POST', 'http://purl.org/la/dp/download_preview',
-    'download_preview', 'application/json')
+    'download_preview', 'application/json', wsgi_wrapper=batch_service)
 def download_preview(body, ctype):
     """
     Reponsible for:  downloading a preview for a document
@@ -1,5 +1,6 @@
 
-from amara.thirdparty import json, httplib2
+from amara.thirdparty import httplib2
+from dplaingestion import jsonio as json
 from amara.lib.iri import join
 from StringIO import StringIO
 from akara import module_config
@@ -13,7 +14,7 @@ import urllib
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 
 """
 This is a module used only for internal testing the module download_preview.
@@ -31,7 +31,7 @@ Adapted 2012 by Jeffrey Licht to support resumption tokens
 
 import sys, time
 
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 
 from akara.services import simple_service
 from akara import logger
@@ -43,16 +43,20 @@ from dplaingestion.oai import oaiservice
 LISTRECORDS_SERVICE_ID = 'http://purl.org/la.dp/dpla-list-records'
 
 @simple_service('GET', LISTRECORDS_SERVICE_ID, 'dpla-list-records', 'application/json')
-def listrecords(endpoint, oaiset=None, resumption_token=None, limit=1000):
+def listrecords(endpoint, oaiset=None, resumption_token=None, limit=1000, from_date=None, until_date=None):
     """
     e.g.:
 
     curl "http://localhost:8880/oai.listrecords.json?oaiset=hdl_1721.1_18193&limit=10"
+
+    from_date and until_date limit the records to those changed in that
+    window (OAI-PMH datestamps, e.g. 2012-10-01). The ids of records deleted
+    in the repository are listed under "deleted".
     """
     limit = int(limit)
 
     remote = oaiservice(endpoint, logger)
-    list_records_result = remote.list_records(set=oaiset,resumption_token=resumption_token)
+    list_records_result = remote.list_records(set=oaiset,resumption_token=resumption_token,from_date=from_date,until_date=until_date)
 
     records = list_records_result['records'][:limit]
     resumption_token = list_records_result['resumption_token'] if 'resumption_token' in list_records_result else ''
@@ -75,7 +79,7 @@ def listrecords(endpoint, oaiset=None, resumption_token=None, limit=1000):
     PROFILE["properties"][:] = strip_unused_profile_properties(PROFILE["properties"],properties_used)
 
     #FIXME: This profile is NOT correct.  Dumb copy from CDM endpoint.  Please fix up below
-    return json.dumps({'items': exhibit_records, 'data_profile': PROFILE, 'resumption_token': resumption_token}, indent=4)
+    return json.dumps({'items': exhibit_records, 'deleted': list_records_result['deleted'], 'data_profile': PROFILE, 'resumption_token': resumption_token}, indent=4)
 
 # Rebuild the data profile by removing optional, unused properties
 strip_unused_profile_properties = lambda prof_props, used: [ p for p in prof_props if p["property"] in used ]
@@ -31,16 +31,23 @@ Forked for DPLA, 2013
 
 import sys, time
 
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 
 from akara.services import simple_service
 from akara import logger
 from akara import module_config
 
+from dplaingestion.cache import SQLiteCache
 from dplaingestion.oai import oaiservice
 
 LISTSETS_SERVICE_ID = 'http://purl.org/la.dp/dpla-list-sets'
 
+# Each listing is stored by endpoint for oai-set-name to read, in full
+# whatever the limit; see the oai_sets section of akara.conf
+SETS_CONFIG = module_config('oai_sets')
+SETS_DBFILE = SETS_CONFIG.get('cache_dbfile')
+SETS_STORE = SQLiteCache(SETS_DBFILE, SETS_CONFIG.get('cache_max_age', 3600)) if SETS_DBFILE else None
+
 @simple_service('GET', LISTSETS_SERVICE_ID, 'oai.listsets.json', 'application/json')
 def listsets(endpoint, limit=100):
     """
@@ -50,5 +57,7 @@ def listsets(endpoint, limit=100):
     """
     limit = int(limit)
     remote = oaiservice(endpoint, logger)
-    sets = remote.list_sets()[:limit]
-    return json.dumps(sets, indent=4)
+    sets = remote.list_sets()
+    if SETS_STORE and sets:
+        SETS_STORE.put_many([(endpoint, sets)])
+    return json.dumps(sets[:limit], indent=4)
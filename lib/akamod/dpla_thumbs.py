@@ -32,7 +32,7 @@ everything is defined in akara.conf.
 
 import sys, time
 
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 
 from akara.services import simple_service
 from akara import logger
@@ -45,7 +45,8 @@ from akara.services import simple_service
 from akara import request, response
 from akara import module_config, logger
 from akara.util import copy_headers_to_dict
-from amara.thirdparty import json, httplib2
+from amara.thirdparty import httplib2
+from dplaingestion import jsonio as json
 from amara.lib.iri import join
 from urllib import quote
 import datetime
@@ -2,13 +2,17 @@ import re
 import timelib
 
 from akara import logger
+from akara import module_config
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
+from datetime import date
 from dateutil.parser import parse as dateutil_parse
 from zen import dateparser
 
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
+from dplaingestion.cache import LRUCache
 
 
 HTTP_INTERNAL_SERVER_ERROR = 500
@@ -27,6 +31,9 @@ DEFAULT_DATETIME = dateutil_parse(DEFAULT_DATETIME_STR)
 # as simple solution, hardcoded UTC seconds is given
 DEFAULT_DATETIME_SECS = 32503680000.0 # UTC seconds for "3000-01-01"
 
+# Parsed dates of the most recently seen strings, shared by both services
+PARSE_CACHE = LRUCache(int(module_config().get('parse_cache_size', 50000)))
+
 
 DATE_RANGE_RE = r'(\S+)\s*-\s*(\S+)'
 def split_date(d):
@@ -34,6 +41,37 @@ def split_date(d):
     return range
 
 DATE_8601 = '%Y-%m-%d'
+# The shapes most dates come in, which don't need the parsers below
+plain_year = re.compile(r"([1-9]\d{3})$") # YYYY
+plain_ymd = re.compile(r"([1-9]\d{3})-(\d{2})-(\d{2})$") # YYYY-MM-DD
+plain_mdy = re.compile(r"(\d{1,2})/(\d{1,2})/([1-9]\d{3})$") # M/D/YYYY
+plain_year_range = re.compile(r"([1-9]\d{3})\s*-\s*([1-9]\d{3})$") # YYYY-YYYY
+def fast_date(d):
+    """
+    Returns the 8601 date of a plain YYYY, YYYY-MM-DD or M/D/YYYY date,
+    giving the same answer as the fuzzy parsers would. Returns None for
+    anything else, including invalid dates, which are left to be cleaned
+    up by them.
+    """
+    match = plain_year.match(d)
+    if match:
+        return match.group(1)
+    match = plain_ymd.match(d)
+    if match:
+        y, m, dd = match.groups()
+    else:
+        match = plain_mdy.match(d)
+        if not match:
+            return None
+        m, dd, y = match.groups()
+    y, m, dd = int(y), int(m), int(dd)
+    try:
+        date(y, m, dd)
+    except ValueError:
+        return None
+    return "%d-%02d-%02d" % (y, m, dd)
+
+circa_re = re.compile("(ca\.|c\.)", re.I)
 def robust_date_parser(d):
     """
     Robust wrapper around some date parsing libs, making a best effort to return
@@ -47,10 +85,17 @@ def robust_date_parser(d):
     strings (fuzzy=True), but at the cost of being forgiving of invalid dates
     in those kinds of strings.
 
+    Common date shapes are recognized by fast_date before trying any of them.
+
     Returns None if it fails
     """
-    circa_re = re.compile("(ca\.|c\.)", re.I)
-    dd = dateparser.to_iso8601(re.sub(circa_re, "", d, count=0).strip()) # simple cleanup prior to parse
+    return fast_date(d) or fuzzy_date_parser(d)
+
+def fuzzy_date_parser(d):
+    """
+    The chain of date parsing libs behind robust_date_parser
+    """
+    dd = dateparser.to_iso8601(circa_re.sub("", d).strip()) # simple cleanup prior to parse
     if dd is None:
         try:
             dd = dateutil_parse(d, fuzzy=True, default=DEFAULT_DATETIME)
@@ -73,11 +118,24 @@ year_range = re.compile("(\d{4})\s*-\s*(\d{4})") # simple for digits year range
 circa_range = re.compile("(?:ca\.|c\.)\s*(?P<century>\d{2})(?P<year_begin>\d{2})\s*-\s*(?P<year_end>\d{2})", re.I) # tricky "c. 1970-90" year range
 century_date = re.compile("(?P<century>\d{1,2})(?:th|st|nd|rd)\s+c\.", re.I) # for dates with centuries "19th c."
 def parse_date_or_range(d):
+    """
+    Returns the (begin, end) dates of d, looking them up in PARSE_CACHE
+    when the same string has been parsed before
+    """
+    return PARSE_CACHE.lookup(d.strip(), parse_uncached)
+
+def parse_uncached(d):
     # FIXME: could be more robust here,
     # e.g. use date range regex to handle:
     # June 1941 - May 1945
     # 1941-06-1945-05
     # and do not confuse with just YYYY-MM-DD regex
+    parsed = fast_date(d)
+    if parsed:
+        return parsed, parsed
+    match = plain_year_range.match(d)
+    if match:
+        return match.groups()
     if ' - ' in d or year_range.match(d):
         a, b = split_date(d)
     elif circa_range.match(d):
@@ -114,7 +172,7 @@ def test_parse_date_or_range():
         assert res == DATE_TESTS[i], "For input '%s', expected '%s' but got '%s'"%(i,DATE_TESTS[i],res)
 
 
-@simple_service('POST', 'http://purl.org/la/dp/enrich-date', 'enrich-date', HTTP_TYPE_JSON)
+@simple_service('POST', 'http://purl.org/la/dp/enrich-date', 'enrich-date', HTTP_TYPE_JSON, wsgi_wrapper=batch_service)
 def enrichdate(body, ctype, action="enrich-format", prop="aggregatedCHO/date"):
     """
     Service that accepts a JSON document and extracts the "created date" of the item, using the
@@ -132,8 +190,8 @@ def enrichdate(body, ctype, action="enrich-format", prop="aggregatedCHO/date"):
 
     date_candidates = []
     for p in prop.split(','):
-        if exists(data, p):
-            v = getprop(data, p)
+        v = getprop_or_default(data, p)
+        if v is not None:
             date_candidates = []
             for s in (v if not isinstance(v, basestring) else [v]):
                 a, b = parse_date_or_range(s)
@@ -148,7 +206,7 @@ def enrichdate(body, ctype, action="enrich-format", prop="aggregatedCHO/date"):
 
     return json.dumps(data)
 
-@simple_service('POST', 'http://purl.org/la/dp/enrich-temporal-date', 'enrich-temporal-date', HTTP_TYPE_JSON)
+@simple_service('POST', 'http://purl.org/la/dp/enrich-temporal-date', 'enrich-temporal-date', HTTP_TYPE_JSON, wsgi_wrapper=batch_service)
 def enrich_temporal_date(body, ctype, prop="aggregatedCHO/temporal", date_key="name"):
     """
     Service that accepts a JSON document and extracts the "created date" of the item, using the
@@ -166,8 +224,8 @@ def enrich_temporal_date(body, ctype, prop="aggregatedCHO/temporal", date_key="n
 
     date_candidates = []
     for p in prop.split(','):
-        if exists(data, p):
-            v = getprop(data, p)
+        v = getprop_or_default(data, p)
+        if v is not None:
             for s in v:
                 a, b = parse_date_or_range(s[date_key])
                 date_candidates.append( {
@@ -1,11 +1,12 @@
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
 import re
 
-@simple_service('POST', 'http://purl.org/la/dp/enrich-format', 'enrich-format', 'application/json')
+@simple_service('POST', 'http://purl.org/la/dp/enrich-format', 'enrich-format', 'application/json', wsgi_wrapper=batch_service)
 def enrichformat(body,ctype,action="enrich-format",prop="isShownAt/format",alternate="aggregatedCHO/physicalMedium"):
     """
     Service that accepts a JSON document and enriches the "format" field of that document
@@ -43,10 +44,10 @@ def enrichformat(body,ctype,action="enrich-format",prop="isShownAt/format",alter
         response.add_header('content-type','text/plain')
         return "Unable to parse body as JSON"
 
-    if exists(data,prop):
-        v = getprop(data,prop)
+    v = getprop_or_default(data,prop)
+    if v is not None:
         format = []
-        physicalFormat = getprop(data,alternate) if exists(data,alternate) else []
+        physicalFormat = getprop_or_default(data,alternate,[])
         if not isinstance(physicalFormat,list):
             physicalFormat = [physicalFormat]
 
@@ -1,11 +1,12 @@
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
 import re
 
-@simple_service('POST', 'http://purl.org/la/dp/enrich-subject', 'enrich-subject', 'application/json')
+@simple_service('POST', 'http://purl.org/la/dp/enrich-subject', 'enrich-subject', 'application/json', wsgi_wrapper=batch_service)
 def enrichsubject(body,ctype,action="enrich-subject",prop="aggregatedCHO/subject"):
     '''   
     Service that accepts a JSON document and enriches the "subject" field of that document
@@ -37,8 +38,8 @@ def enrichsubject(body,ctype,action="enrich-subject",prop="aggregatedCHO/subject
         response.add_header('content-type','text/plain')
         return "Unable to parse body as JSON"
 
-    if exists(data,prop):
-        v = getprop(data,prop)
+    v = getprop_or_default(data,prop)
+    if v is not None:
         subject = []
         for s in (v if not isinstance(v,basestring) else [v]):
             subj = cleanup(s)
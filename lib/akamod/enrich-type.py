@@ -1,11 +1,12 @@
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
 import re
 
-@simple_service('POST', 'http://purl.org/la/dp/enrich-type', 'enrich-type', 'application/json')
+@simple_service('POST', 'http://purl.org/la/dp/enrich-type', 'enrich-type', 'application/json', wsgi_wrapper=batch_service)
 def enrichtype(body,ctype,action="enrich-type", prop="aggregatedCHO/type", alternate="aggregatedCHO/physicalMedium"):
     """   
     Service that accepts a JSON document and enriches the "type" field of that document
@@ -40,10 +41,10 @@ def enrichtype(body,ctype,action="enrich-type", prop="aggregatedCHO/type", alter
         response.add_header('content-type','text/plain')
         return "Unable to parse body as JSON"
 
-    if exists(data,prop):
-        v = getprop(data,prop)
+    v = getprop_or_default(data,prop)
+    if v is not None:
         dctype = []
-        physicalFormat = getprop(data,alternate) if exists(data,alternate) else []
+        physicalFormat = getprop_or_default(data,alternate,[])
         if not isinstance(physicalFormat,list):
             physicalFormat = [physicalFormat]
 
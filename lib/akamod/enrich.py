@@ -1,10 +1,29 @@
 from akara.services import simple_service
 from akara import request, response
 from akara import module_config, logger
+from akara import registry
+from akara import global_config
 from akara.util import copy_headers_to_dict
-from amara.thirdparty import json, httplib2
+from amara.thirdparty import httplib2
+from dplaingestion import jsonio as json
 from amara.lib.iri import join
+from urlparse import urlsplit
+from cStringIO import StringIO
+from dplaingestion.batch import BATCH_HEADER, BATCH_ENVIRON
+from dplaingestion.cache import LRUCache
+from multiprocessing.pool import ThreadPool
+from itertools import imap, izip
 from urllib import quote
+import cProfile
+import pstats
+import fcntl
+import errno
+import math
+import random
+import threading
+import time
+import os
+import hashlib
 import datetime
 import uuid
 import base64
@@ -19,6 +38,68 @@ COUCH_ID_BUILDER = lambda src, lname: "--".join((src,lname))
 # FIXME it's looking like an id builder needs to be part of the profile. Or UUID as fallback?
 COUCH_REC_ID_BUILDER = lambda src, rec: COUCH_ID_BUILDER(src,rec.get(u'id','no-id').strip().replace(" ","__"))
 
+# Run pipeline stages mounted in this Akara instance as direct handler calls
+# rather than loopback HTTP requests
+INPROCESS_PIPELINE = module_config().get('inprocess_pipeline', True)
+LOCAL_HOSTS = ('localhost', '127.0.0.1')
+# Number of records sent through each stage per request; 0 for one at a time
+BATCH_SIZE = int(module_config().get('batch_size', 100))
+# Number of records (or batches) run through the pipeline concurrently. The
+# workers call every stage over HTTP, so that stages mounted in this server run
+# on its other processes; keep it below Akara's MaxServers. With one worker,
+# those stages are called in-process
+MAX_WORKERS = int(module_config().get('max_workers', 1))
+# _bulk_docs requests are flushed every BULK_MAX_DOCS docs or BULK_MAX_BYTES of
+# JSON, whichever comes first. Failed docs are retried up to BULK_RETRIES times
+BULK_MAX_DOCS = int(module_config().get('bulk_max_docs', 500))
+BULK_MAX_BYTES = int(module_config().get('bulk_max_bytes', 8*1024*1024))
+BULK_RETRIES = int(module_config().get('bulk_retries', 3))
+# Revisions of the docs written or looked up by this process, by (source, id),
+# kept across the enrich requests of a harvest. None records that a doc doesn't
+# exist. Entries can go stale when another process writes the same docs; the
+# bulk writer then gets a conflict and refetches
+REV_CACHE = LRUCache(int(module_config().get('rev_cache_max', 200000)))
+UNKNOWN_REV = object()
+# Records whose harvested form, along with the record pipeline, hashes the same
+# as the originalRecordHash already stored in CouchDB are neither enriched nor
+# written again, unless the request has a "Skip-Unchanged: 0" header. Needs the
+# view in couchdb_views/ingest.js; without it every record is processed. The
+# same view finds the docs of records listed as deleted
+SKIP_UNCHANGED = int(module_config().get('skip_unchanged', 1))
+COUCH_HASH_VIEW = '_design/ingest/_view/original_record_hash'
+# Top-level subtrees of each record, by key, which the record pipeline's stages
+# pass through untouched. They're kept out of the stage requests and put back
+# before the record is stored, except that each is sent to the stages (by mount
+# point) listed for it, which read it. Requests lacking any of them name them
+# in the Pipeline-Elided header
+PASSTHROUGH = module_config().get('passthrough', {
+    u'originalRecord': ['artstor_select_isshownat', 'artstor_identify_object',
+                        'contentdm_identify_object', 'georgia_identify_object']
+})
+ELIDED_HEADER = 'Pipeline-Elided'
+ELIDED_ENVIRON = 'HTTP_PIPELINE_ELIDED'
+# Stage calls are timed per source and stage URI (see GET /enrich-stats). Each
+# Akara process saves its numbers to STATS_DIR at most every STATS_INTERVAL
+# seconds, for enrich-stats to add up; those of processes that have exited are
+# folded into one file. With server_timing set, enrich also answers with a
+# Server-Timing header giving the time spent in each stage for that request
+STATS_DIR = module_config().get('stats_dir')
+STATS_INTERVAL = float(module_config().get('stats_interval', 5))
+SERVER_TIMING = int(module_config().get('server_timing', 0))
+# Call times are counted in buckets, each LATENCY_GROWTH times as wide as the
+# one before and starting from LATENCY_BASE seconds, so that the counts of
+# different processes add up exactly. Percentiles are given to within a bucket
+LATENCY_BASE = 0.0001
+LATENCY_GROWTH = 1.1
+# A request with a "Profile-Pipeline: <sample-rate>" header runs about that
+# fraction of its records (or batches) through in-process stages under
+# cProfile, and adds the profile of each stage to the pstats file kept for it
+# under PROFILE_DIR, by source and collection
+PROFILE_DIR = module_config().get('profile_dir')
+# Pipelines compiled from Pipeline-Coll/Pipeline-Rec header values, so each
+# distinct pipeline is only worked out once
+PLANS = LRUCache(int(module_config().get('plan_cache_size', 1000)))
+
 COUCH_AUTH_HEADER = { 'Authorization' : 'Basic ' + base64.encodestring(COUCH_DATABASE_USERNAME+":"+COUCH_DATABASE_PASSWORD) }
 
 # FIXME: this should be JSON-LD, but CouchDB doesn't support +json yet
@@ -28,51 +109,662 @@ CT_JSON = {'Content-Type': 'application/json'}
 H = httplib2.Http()
 H.force_exception_as_status_code = True
 
+# Stage calls from worker threads can't share H, so each thread gets its own
+# Http, which keeps its connections to the stages open between calls.
+# In-process stages swap the module-level akara.request/akara.response, so
+# they are only called from the thread handling the enrich request.
+WORKER = threading.local()
+
+def stage_http():
+    if not hasattr(WORKER,'h'):
+        WORKER.h = httplib2.Http()
+        WORKER.h.force_exception_as_status_code = True
+    return WORKER.h
+
+def local_service(uri,environ):
+    '''
+    Returns the Akara service mounted at uri if it belongs to the server
+    instance environ was given by, or None if the stage has to be called over
+    HTTP
+    '''
+    if not INPROCESS_PIPELINE:
+        return None
+    scheme, netloc, path, query, fragment = urlsplit(uri)
+    if netloc != environ.get('HTTP_HOST'):
+        host, _, port = netloc.partition(':')
+        if host not in LOCAL_HOSTS or (port or '80') != environ.get('SERVER_PORT'):
+            return None
+    mount_point = path.strip('/')
+    if not mount_point or '/' in mount_point:
+        return None
+    try:
+        return registry.get_service(mount_point)
+    except KeyError:
+        return None
+
+class Stage(object):
+    '''
+    A stage of a Plan: its URI and query, the local service mounted at it (or
+    None if it is called over HTTP), and which PASSTHROUGH subtrees it reads
+    and goes without
+    '''
+    def __init__(self,uri,environ):
+        self.uri = uri
+        scheme, netloc, path, self.query, fragment = urlsplit(uri)
+        self.service = local_service(uri,environ)
+        name = path.strip('/').rsplit('/',1)[-1]
+        self.read = [ key for key, readers in PASSTHROUGH.iteritems() if name in readers ]
+        self.elided = [ key for key in PASSTHROUGH if key not in self.read ]
+
+    def subtrees(self,detached):
+        '''
+        Returns the keys of the detached subtrees the stage reads, and those it
+        goes without
+        '''
+        if detached is None:
+            return [], []
+        return self.read, self.elided
+
+class Plan(object):
+    '''
+    A pipeline compiled from the value of its Pipeline-Coll or Pipeline-Rec
+    header, wsgi_header being the header's key in the WSGI environ
+    '''
+    def __init__(self,value,wsgi_header,environ):
+        self.wsgi_header = wsgi_header
+        self.stages = [ Stage(uri,environ) for uri in value.split(',') if uri ]
+        self.uris = [ stage.uri for stage in self.stages ]
+
+def compile_plan(value,wsgi_header,environ):
+    '''
+    Returns the Plan of a pipeline header value, as cached for the server
+    instance environ was given by
+    '''
+    key = (wsgi_header,value,environ.get('HTTP_HOST'),environ.get('SERVER_PORT'))
+    return PLANS.lookup(key,lambda key: Plan(value,wsgi_header,environ))
+
+class Pipeline(object):
+    '''
+    A Plan bound to the enrich request it runs for, with the headers (or for
+    in-process stages, the WSGI environ) of each of its stage calls worked out
+    up front. Calls are keyed by stage, whether they are batches and whether
+    PASSTHROUGH subtrees are elided. Unless inprocess is True, local stages
+    are called over HTTP like the others.
+    '''
+    def __init__(self,plan,environ,ctype,inprocess=True):
+        self.plan = plan
+        self.stages = plan.stages
+        self.inprocess = inprocess
+        self.source = environ.get('HTTP_SOURCE')
+        exclude = [plan.wsgi_header,BATCH_ENVIRON,ELIDED_ENVIRON]
+        headers = copy_headers_to_dict(environ,exclude=exclude)
+        headers['content-type'] = ctype
+        local = dict((k,v) for k, v in environ.iteritems() if k not in exclude)
+        local.update({'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': ctype})
+        self.headers, self.environs = {}, {}
+        for stage in plan.stages:
+            for batch in (False,True):
+                for elide in (False,True):
+                    if stage.service and inprocess:
+                        call = dict(local)
+                        call.update({'PATH_INFO': '/' + stage.service.path, 'QUERY_STRING': stage.query})
+                        batch_key, elided_key = BATCH_ENVIRON, ELIDED_ENVIRON
+                        self.environs[stage,batch,elide] = call
+                    else:
+                        call = dict(headers)
+                        batch_key, elided_key = BATCH_HEADER, ELIDED_HEADER
+                        self.headers[stage,batch,elide] = call
+                    if batch:
+                        call[batch_key] = 'true'
+                    if elide and stage.elided:
+                        call[elided_key] = ','.join(stage.elided)
+
+def call_local(pipeline,stage,body,batch=False,elide=False,profiles=None):
+    '''
+    Invokes the WSGI handler of a local stage with the environ the pipeline
+    worked out for the call, returning (status,headers,content) like
+    call_stage. The handler resets akara.request/akara.response, so ours are
+    restored after; it must be called from the thread handling our request.
+    If profiles is given, the handler runs under cProfile and its profile is
+    added to profiles[stage.uri].
+    '''
+    environ = pipeline.environs[stage,batch,elide].copy()
+    environ.update({
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': StringIO(body)
+    })
+    status, headers = [], {}
+    def start_response(code, response_headers, exc_info=None):
+        status.append(code)
+        headers.update((k.lower(),v) for k, v in response_headers)
+
+    saved = (request.environ, response.code, response.headers)
+    try:
+        handle = lambda: ''.join(stage.service.handler(environ, start_response))
+        if profiles is None:
+            content = handle()
+        else:
+            profiler = cProfile.Profile()
+            try:
+                content = profiler.runcall(handle)
+            finally:
+                add_profile(profiles,stage.uri,profiler)
+    except Exception as e:
+        logger.exception("Uncaught exception from in-process stage %s"%stage.uri)
+        return '500', {}, repr(e)
+    finally:
+        request.environ, response.code, response.headers = saved
+    return (status[0].split(' ',1)[0] if status else '500'), headers, content
+
+def latency_bucket(elapsed):
+    if elapsed <= LATENCY_BASE:
+        return 0
+    return int(math.ceil(math.log(elapsed/LATENCY_BASE,LATENCY_GROWTH)))
+
+class StageStats(object):
+    'Counts and timings of the calls made to a pipeline stage'
+    FIELDS = ('calls','records','errors','bytes_in','bytes_out','total','min','max')
+
+    def __init__(self,state=None):
+        self.calls = self.records = self.errors = 0
+        self.bytes_in = self.bytes_out = 0
+        self.total = self.max = 0.0
+        self.min = None
+        self.latencies = {} # calls by latency_bucket
+        if state:
+            self.merge(state)
+
+    def state(self):
+        'Returns the numbers as a dict, for saving and merging'
+        state = dict((f,getattr(self,f)) for f in self.FIELDS)
+        state['latencies'] = self.latencies.copy()
+        return state
+
+    def merge(self,state):
+        'Adds in the numbers of another StageStats, given by its state()'
+        for f in ('calls','records','errors','bytes_in','bytes_out','total'):
+            setattr(self,f,getattr(self,f) + state[f])
+        if state['min'] is not None:
+            self.min = state['min'] if self.min is None else min(self.min,state['min'])
+        self.max = max(self.max,state['max'])
+        for bucket, calls in state['latencies'].iteritems():
+            bucket = int(bucket) # JSON keys are strings
+            self.latencies[bucket] = self.latencies.get(bucket,0) + calls
+
+    def add(self,elapsed,records,bytes_in,bytes_out,ok):
+        self.calls += 1
+        self.records += records
+        self.errors += not ok
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.total += elapsed
+        self.min = elapsed if self.min is None else min(self.min,elapsed)
+        self.max = max(self.max,elapsed)
+        bucket = latency_bucket(elapsed)
+        self.latencies[bucket] = self.latencies.get(bucket,0) + 1
+
+    def percentile(self,p):
+        'Returns the upper bound of the bucket the p-th fraction of calls fall in'
+        count = sum(self.latencies.itervalues())
+        if not count:
+            return None
+        rank = min(count-1,int(p*count))
+        for bucket in sorted(self.latencies):
+            rank -= self.latencies[bucket]
+            if rank < 0:
+                return min(max(LATENCY_BASE*LATENCY_GROWTH**bucket,self.min),self.max)
+
+    def summary(self):
+        return {
+            u'calls': self.calls, u'records': self.records, u'errors': self.errors,
+            u'bytes_in': self.bytes_in, u'bytes_out': self.bytes_out,
+            u'total': self.total, u'min': self.min, u'max': self.max,
+            u'mean': self.total/self.calls if self.calls else None,
+            u'p50': self.percentile(0.5), u'p90': self.percentile(0.9), u'p99': self.percentile(0.99)
+        }
+
+# StageStats by source, then by stage URI
+STAGE_STATS = {}
+STATS_LOCK = threading.Lock()
+STATS_SAVED = [0]
+# The pid STAGE_STATS were last saved by, as a process reusing the pid of one
+# that has exited finds its file
+STATS_SAVED_BY = [None]
+# Where the stats of processes that have exited are added up
+STATS_AGGREGATE = 'aggregate.json'
+
+def stats_dir():
+    return STATS_DIR or os.path.join(global_config.module_cache,'enrich-stats')
+
+def stats_state(stats):
+    'Returns the state() of StageStats by source and stage URI'
+    return dict((src, dict((uri, s.state()) for uri, s in by_uri.iteritems()))
+                for src, by_uri in stats.iteritems())
+
+def write_stats(path,text):
+    with open(path+'.tmp','w') as f:
+        f.write(text)
+    os.rename(path+'.tmp',path)
+
+def merge_stats_file(merged,path):
+    'Adds the stats saved in path to merged StageStats, by source and stage URI'
+    try:
+        saved = json.load(open(path))
+    except (IOError, ValueError):
+        return
+    for src, by_uri in saved.iteritems():
+        for uri, state in by_uri.iteritems():
+            stats = merged.setdefault(src,{})
+            if uri in stats:
+                stats[uri].merge(state)
+            else:
+                stats[uri] = StageStats(state)
+
+def process_exited(pid):
+    try:
+        os.kill(pid,0)
+    except OSError as e:
+        return e.errno == errno.ESRCH
+    return False
+
+def stats_lock(directory):
+    'Returns the open lock file of stats files in directory, locked'
+    lock = open(os.path.join(directory,'.lock'),'w')
+    fcntl.flock(lock,fcntl.LOCK_EX)
+    return lock
+
+def fold_stats(directory,names):
+    '''
+    Adds the stats in the files with the given names, left by processes that
+    have exited, to the aggregate file and removes them. Takes the lock
+    '''
+    with stats_lock(directory):
+        paths = [ os.path.join(directory,name) for name in names ]
+        paths = [ path for path in paths if os.path.exists(path) ] # Unless another process beat us to it
+        if not paths:
+            return
+        merged = {}
+        aggregate = os.path.join(directory,STATS_AGGREGATE)
+        merge_stats_file(merged,aggregate)
+        for path in paths:
+            merge_stats_file(merged,path)
+        write_stats(aggregate,json.dumps(stats_state(merged)))
+        for path in paths:
+            os.remove(path)
+
+def save_stage_stats(force=False):
+    '''
+    Writes this process's STAGE_STATS to a file of its own in stats_dir(),
+    unless they were saved less than STATS_INTERVAL seconds ago, and folds in
+    the files of processes that have exited
+    '''
+    with STATS_LOCK:
+        if not force and time.time() - STATS_SAVED[0] < STATS_INTERVAL:
+            return
+        STATS_SAVED[0] = time.time()
+        text = json.dumps(stats_state(STAGE_STATS))
+    directory = stats_dir()
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        pid = os.getpid()
+        name = '%d.json'%pid
+        if STATS_SAVED_BY[0] != pid:
+            fold_stats(directory,[name])
+            STATS_SAVED_BY[0] = pid
+        write_stats(os.path.join(directory,name),text)
+        stale = [ n for n in os.listdir(directory)
+                  if n.endswith('.json') and n[:-5].isdigit() and process_exited(int(n[:-5])) ]
+        if stale:
+            fold_stats(directory,stale)
+    except (IOError, OSError) as e:
+        logger.error("Unable to save stage stats: %r"%e)
+
+def load_stage_stats():
+    'Returns the StageStats saved by all processes, added up by source and stage URI'
+    merged = {}
+    directory = stats_dir()
+    if not os.path.isdir(directory):
+        return merged
+    with stats_lock(directory):
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                merge_stats_file(merged,os.path.join(directory,name))
+    return merged
+
+def record_stage_call(source,uri,elapsed,records,bytes_in,bytes_out,ok,timings=None):
+    '''
+    Adds a stage call to STAGE_STATS, and its time to timings (by stage URI)
+    if given
+    '''
+    with STATS_LOCK:
+        stats = STAGE_STATS.setdefault(source,{})
+        if uri not in stats:
+            stats[uri] = StageStats()
+        stats[uri].add(elapsed,records,bytes_in,bytes_out,ok)
+        if timings is not None:
+            timings[uri] = timings.get(uri,0) + elapsed
+
+def server_timing(enrichments,timings):
+    'Returns a Server-Timing header value giving the time (ms) spent in each stage'
+    metrics = []
+    for uri in enrichments:
+        if uri in timings and uri not in metrics:
+            metrics.append(uri)
+    return ', '.join('stage%d;dur=%.1f;desc="%s"'%(i+1,timings[uri]*1000,uri.replace('"','%22'))
+                     for i, uri in enumerate(metrics))
+
+def add_profile(profiles,uri,profiler):
+    profiler.create_stats()
+    if uri in profiles:
+        profiles[uri].add(profiler)
+    else:
+        profiles[uri] = pstats.Stats(profiler)
+
+def profile_dir(source,collection):
+    root = PROFILE_DIR or os.path.join(global_config.module_cache,'enrich-profiles')
+    return os.path.join(root,quote(source or '',safe=''),quote(collection or '',safe=''))
+
+def save_profiles(source,collection,profiles):
+    '''
+    Adds the profiles of a request's stages, by stage URI, to the pstats file
+    kept for each under profile_dir(source,collection)
+    '''
+    directory = profile_dir(source,collection)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for uri, stats in profiles.iteritems():
+            scheme, netloc, path, query, fragment = urlsplit(uri)
+            name = os.path.join(directory,quote(path.strip('/')+('?'+query if query else ''),safe='')+'.pstats')
+            # Other processes may be adding to the same file
+            with open(name+'.lock','w') as lock:
+                fcntl.flock(lock,fcntl.LOCK_EX)
+                if os.path.exists(name):
+                    stats.add(name)
+                stats.dump_stats(name)
+        logger.debug("Saved profiles of %d stages to %s"%(len(profiles),directory))
+    except (IOError, OSError) as e:
+        logger.error("Unable to save pipeline profiles: %r"%e)
+
+def call_stage(pipeline,stage,body,batch=False,elide=False,records=1,timings=None,profiles=None):
+    '''
+    Calls a pipeline stage with send_to_stage, recording the time it took
+    '''
+    start = time.time()
+    status, headers, cont = send_to_stage(pipeline,stage,body,batch,elide,profiles)
+    record_stage_call(pipeline.source,stage.uri,time.time()-start,records,len(body),len(cont),
+                      status.startswith('2'),timings)
+    return status, headers, cont
+
+def send_to_stage(pipeline,stage,body,batch=False,elide=False,profiles=None):
+    '''
+    POSTs body to a pipeline stage, in-process if the stage is mounted locally
+    and the pipeline calls local stages in-process. Returns
+    (status,headers,content), with lowercased header names. In-process stages
+    are profiled into profiles, if given
+    '''
+    if stage.service and pipeline.inprocess:
+        logger.debug("Calling in-process: %s " % stage.uri)
+        return call_local(pipeline,stage,body,batch,elide,profiles)
+
+    logger.debug("Calling url: %s " % stage.uri)
+    resp, cont = stage_http().request(stage.uri,'POST',body=body,headers=pipeline.headers[stage,batch,elide])
+    return str(resp.status), resp, cont
+
+def with_subtrees(body,detached,keys,batch=False):
+    '''
+    Returns the JSON text of body, a record or a batch of them, with the
+    subtrees under keys put back from detached (one dict per record)
+    '''
+    data = json.loads(body)
+    for item, subtrees in izip(data[u'items'] if batch else [data], detached if batch else [detached]):
+        for key in keys:
+            if key in subtrees:
+                item[key] = subtrees[key]
+    return json.dumps(data)
+
+def without_subtrees(body,keys,batch=False):
+    'Returns the JSON text of body, a record or a batch of them, less the subtrees under keys'
+    data = json.loads(body)
+    for item in (data[u'items'] if batch else [data]):
+        if isinstance(item,dict):
+            for key in keys:
+                item.pop(key,None)
+    return json.dumps(data)
+
 # FIXME: should support changing media type in a pipeline
-def pipe(content,ctype,enrichments,wsgi_header):
+def pipe(content,pipeline,detached=None,timings=None,profiles=None):
+    '''
+    Runs a record through the pipeline, returning its JSON text. detached holds
+    the record's PASSTHROUGH subtrees, if they have been taken out of it. The
+    time spent in each stage is added to timings, and in-process stages are
+    profiled into profiles, if given
+    '''
     body = json.dumps(content)
-    for uri in enrichments:
-        if len(uri) < 1: continue # in case there's no pipeline
-        headers = copy_headers_to_dict(request.environ,exclude=[wsgi_header])
-        headers['content-type'] = ctype
-        logger.debug("Calling url: %s " % uri)
-        resp, cont = H.request(uri,'POST',body=body,headers=headers)
-        if not str(resp.status).startswith('2'):
-            logger.debug("Error in enrichment pipeline at %s: %s"%(uri,repr(resp)))
+    elide = detached is not None
+    for stage in pipeline.stages:
+        read, elided = stage.subtrees(detached)
+        status, headers, cont = call_stage(pipeline,stage,with_subtrees(body,detached,read) if read else body,
+                                           elide=elide,timings=timings,profiles=profiles)
+        if not status.startswith('2'):
+            logger.debug("Error in enrichment pipeline at %s: %s"%(stage.uri,status))
+            continue
+
+        body = without_subtrees(cont,read) if read else cont
+    return body
+
+def pipe_batch(contents,pipeline,detached=None,timings=None,profiles=None):
+    '''
+    Runs a list of records through the pipeline with one request per stage,
+    using the batch contract of dplaingestion.batch. Stages which don't answer
+    with a batch get the records one at a time instead. Returns the JSON text
+    of {"items": [...]}. detached lists the records' PASSTHROUGH subtrees, if
+    they have been taken out of them. The time spent in each stage is added to
+    timings, and in-process stages are profiled into profiles, if given
+    '''
+    body = json.dumps({u'items': contents})
+    elide = detached is not None
+    for stage in pipeline.stages:
+        read, elided = stage.subtrees(detached)
+        stage_body = with_subtrees(body,detached,read,batch=True) if read else body
+        status, headers, cont = call_stage(pipeline,stage,stage_body,batch=True,elide=elide,
+                                           records=len(contents),timings=timings,profiles=profiles)
+        if status.startswith('2') and headers.get(BATCH_HEADER.lower()):
+            body = without_subtrees(cont,read,batch=True) if read else cont
             continue
 
-        body = cont
+        logger.debug("No batch support at %s (%s), calling it per record"%(stage.uri,status))
+        items = []
+        for item in json.loads(stage_body)[u'items']:
+            item_body = json.dumps(item)
+            status, headers, cont = call_stage(pipeline,stage,item_body,elide=elide,
+                                               timings=timings,profiles=profiles)
+            if not status.startswith('2'):
+                logger.debug("Error in enrichment pipeline at %s: %s"%(stage.uri,status))
+                cont = item_body
+            items.append(cont)
+        body = '{"items": [' + ', '.join(items) + ']}'
+        if read:
+            body = without_subtrees(body,read,batch=True)
     return body
 
-# FIXME: should be able to optionally skip the revision checks for initial ingest
 def couch_rev_check_coll(docuri,doc):
     'Add current revision to body so we can update it'
     resp, cont = H.request(docuri,'GET',headers=COUCH_AUTH_HEADER)
     if str(resp.status).startswith('2'):
         doc['_rev'] = json.loads(cont)['_rev']
 
-def couch_rev_check_recs(docs,src):
+def couch_known_revs(ids,src):
     '''
-    Insert revisions for all records into structure using CouchDB bulk interface.
-    Uses key ranges to narrow bulk query to the source being ingested.
+    Returns {id: rev} for those of the docs with the given ids that exist. Ids
+    not in REV_CACHE are looked up with a single keyed request to the CouchDB
+    bulk interface, so the cost follows the batch size rather than the
+    database size.
     '''
-    uri = join(COUCH_DATABASE,'_all_docs')
-    start = quote(COUCH_ID_BUILDER(src,''))
-    end = quote(COUCH_ID_BUILDER(src,'Z'*100)) # FIXME. Is this correct?
-    uri += '?startkey=%s&endkey=%s'%(start,end)
-    resp, cont = H.request(join(COUCH_DATABASE,'_all_docs'),'GET',headers=COUCH_AUTH_HEADER)
+    known, missing = {}, []
+    for id in ids:
+        rev = REV_CACHE.get((src,id),UNKNOWN_REV)
+        if rev is UNKNOWN_REV:
+            missing.append(id)
+        elif rev:
+            known[id] = rev
+    if missing:
+        revs = couch_fetch_revs(missing)
+        if revs is not None:
+            for id in missing:
+                REV_CACHE.put((src,id),revs.get(id))
+                if id in revs:
+                    known[id] = revs[id]
+    return known
+
+def couch_fetch_revs(ids):
+    'Returns the current revisions of the docs with the given ids keyed by id, or None on error'
+    resp, cont = H.request(join(COUCH_DATABASE,'_all_docs'),'POST',body=json.dumps({'keys': ids}),headers=dict(CT_JSON.items()+COUCH_AUTH_HEADER.items()))
+    revs = {}
     if str(resp.status).startswith('2'):
-        rows = json.loads(cont)["rows"]
-        #revs = { r["id"]:r["value"]["rev"] for r in rows } # 2.7 specific
-        revs = {}
-        for r in rows:
-            revs[r["id"]] = r["value"]["rev"]
-        for doc in docs:
-            id = doc['_id']
-            if id in revs:
-                doc['_rev'] = revs[id]
+        for r in json.loads(cont)["rows"]:
+            if 'value' in r and not r['value'].get('deleted'):
+                revs[r["id"]] = r["value"]["rev"]
+    else:
+        logger.debug('Unable to retrieve document revisions by key: '+repr(resp))
+        return None
+    return revs
+
+def record_hash(record,pipeline=''):
+    '''
+    Stable hash of a record as harvested and the Pipeline-Rec value it is
+    enriched by, stored with its doc as originalRecordHash, so that a record is
+    enriched again when its profile's record enrichments change
+    '''
+    h = hashlib.sha1(json.dumps(record,sort_keys=True))
+    if pipeline:
+        h.update('\n' + pipeline)
+    return h.hexdigest()
+
+def couch_fetch_hashes(src,keys):
+    '''
+    Returns {record id: (doc id, rev, hash)} for the docs of src stored from the
+    records with the given ids, or {} if they can't be looked up
+    '''
+    uri = join(COUCH_DATABASE,COUCH_HASH_VIEW)
+    resp, cont = H.request(uri,'POST',body=json.dumps({'keys': keys}),headers=dict(CT_JSON.items()+COUCH_AUTH_HEADER.items()))
+    if not str(resp.status).startswith('2'):
+        logger.debug("Error fetching record hashes from Couch: "+repr((resp,cont)))
+        return {}
+    # Record ids are only unique within a source
+    prefix = COUCH_ID_BUILDER(src,'')
+    stored = {}
+    for row in json.loads(cont)[u'rows']:
+        if row.get(u'id','').startswith(prefix):
+            stored[row[u'key']] = (row[u'id'],) + tuple(row[u'value'])
+    return stored
+
+def couch_delete_records(src,record_ids):
+    '''
+    Deletes the docs of src stored from the records with the given ids, such as
+    those the provider reports as deleted
+    '''
+    stored = couch_fetch_hashes(src,record_ids)
+    writer = CouchBulkWriter(src,check_revs=False)
+    for doc_id, rev, rhash in stored.itervalues():
+        writer.add({'_id': doc_id, '_rev': rev, '_deleted': True})
+    writer.flush()
+    # The tombstone revisions aren't wanted if the records come back
+    for doc_id, rev, rhash in stored.itervalues():
+        REV_CACHE.pop((src,doc_id))
+    logger.debug("Deleted %d of %d records reported deleted"%(len(stored),len(record_ids)))
+
+class CouchBulkWriter(object):
+    '''
+    Writes docs to CouchDB through _bulk_docs in bounded chunks rather than in a
+    single request. Docs are serialized as they're added, only their JSON is
+    kept, and the chunk is flushed every max_docs docs or max_bytes of JSON.
+    The ids of the docs written and of those that couldn't be are kept in
+    written and failed.
+
+    Revisions are looked up before each flush unless check_revs is False, as
+    for an initial ingest. CouchDB answers with a status per doc. Docs which
+    conflicted are given their current revision (or none, if they have been
+    deleted) and resent, as is the whole
+    chunk if the request itself failed, up to max_retries times. Other per-doc
+    errors are logged.
+    '''
+    def __init__(self,src,check_revs=True,max_docs=BULK_MAX_DOCS,max_bytes=BULK_MAX_BYTES,max_retries=BULK_RETRIES):
+        self.src = src
+        self.check_revs = check_revs
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.uri = join(COUCH_DATABASE,'_bulk_docs')
+        self.pending = [] # (id,rev,text) triples
+        self.size = 0
+        self.written = []
+        self.failed = []
+
+    def add(self,doc):
+        text = json.dumps(doc)
+        self.pending.append((doc['_id'],doc.get('_rev'),text))
+        self.size += len(text)
+        if len(self.pending) >= self.max_docs or self.size >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending, self.size = self.pending, [], 0
+        if self.check_revs:
+            revs = couch_known_revs([ id for id, rev, text in pending if not rev ],self.src)
+            pending = [ (id, revs[id], with_rev(text,revs[id])) if not rev and id in revs else (id, rev, text)
+                        for id, rev, text in pending ]
+        for attempt in xrange(self.max_retries+1):
+            pending = self.post(pending)
+            if not pending:
+                return
+        logger.error("Giving up on %d docs after %d attempts: %s"%(len(pending),self.max_retries+1,
+                                                                   ', '.join(id for id, rev, text in pending)))
+        self.failed.extend(id for id, rev, text in pending)
+
+    def post(self,pending):
+        'Sends one _bulk_docs request, returning the (id,rev,text) triples to retry'
+        body = '{"docs": [' + ', '.join(text for id, rev, text in pending) + ']}'
+        resp, content = H.request(self.uri,'POST',body=body,headers=dict(CT_JSON.items()+COUCH_AUTH_HEADER.items()))
+        if not str(resp.status).startswith('2'):
+            logger.debug('HTTP error posting to CouchDB: '+repr((resp,content)))
+            return pending
+
+        conflicts = []
+        for (id, rev, text), result in zip(pending,json.loads(content)):
+            if 'error' not in result:
+                REV_CACHE.put((self.src,result['id']),result['rev'])
+                self.written.append(id)
+            elif result['error'] == 'conflict':
+                conflicts.append((id, rev, text))
+            else:
+                logger.debug("CouchDB rejected %s: %s"%(result.get('id'),repr(result)))
+                self.failed.append(id)
+        if conflicts:
+            logger.debug("Retrying %d conflicted docs"%len(conflicts))
+            revs = couch_fetch_revs([ id for id, rev, text in conflicts ])
+            if revs is not None:
+                # Docs missing from the refetch were deleted since their rev
+                # was cached, and are written again without one
+                for id, rev, text in conflicts:
+                    if id in revs:
+                        REV_CACHE.put((self.src,id),revs[id])
+                    else:
+                        REV_CACHE.pop((self.src,id))
+                conflicts = [ (id, revs.get(id), with_rev(text,revs.get(id))) for id, rev, text in conflicts ]
+        return conflicts
+
+def with_rev(text,rev):
+    'Returns the JSON text of a doc with its _rev set to rev, or taken out if rev is None'
+    doc = json.loads(text)
+    if rev:
+        doc['_rev'] = rev
     else:
-        logger.debug('Unable to retrieve document revisions via bulk interface: '+repr(resp))
+        doc.pop('_rev',None)
+    return json.dumps(doc)
 
 def set_ingested_date(doc):
     doc[u'ingestDate'] = datetime.datetime.now().isoformat()
@@ -81,7 +773,10 @@ def set_ingested_date(doc):
 def enrich(body,ctype):
     '''   
     Establishes a pipeline of services identified by an ordered list of URIs provided
-    in two request headers, one for collections and one for records
+    in two request headers, one for collections and one for records. Returns the
+    enriched records as {"docs": [...]}. With a "Return-Docs: 0" header, records
+    stored in CouchDB aren't kept for the response, which instead gives the ids
+    of the docs stored and failed as {"stored": [...], "failed": [...]}
     '''
 
     request_headers = copy_headers_to_dict(request.environ)
@@ -93,8 +788,21 @@ def enrich(body,ctype):
         response.add_header('content-type','text/plain')
         return "Source and Collection request headers are required"
 
-    coll_enrichments = request_headers.get(u'Pipeline-Coll','').split(',')
-    rec_enrichments = request_headers.get(u'Pipeline-Rec','').split(',')
+    # On an initial ingest the docs can't exist yet, so revisions are only
+    # fetched for the ones CouchDB reports as conflicts
+    initial_ingest = request_headers.get('Ingest-Mode','').lower() == 'initial'
+
+    coll_pipeline = Pipeline(compile_plan(request_headers.get(u'Pipeline-Coll',''),'HTTP_PIPELINE_COLL',request.environ),
+                             request.environ,ctype)
+    rec_plan = compile_plan(request_headers.get(u'Pipeline-Rec',''),'HTTP_PIPELINE_REC',request.environ)
+
+    try:
+        profile_rate = float(request_headers.get('Profile-Pipeline',0))
+    except ValueError:
+        profile_rate = 0
+    # Profiles of the in-process stages of sampled runs of the pipelines, by stage URI
+    profiles = {}
+    sampled = lambda: profiles if profile_rate > 0 and random.random() < profile_rate else None
 
     data = json.loads(body)
 
@@ -107,25 +815,55 @@ def enrich(body,ctype):
         "ingestType": "collection"
     }
     # Set collection title field from collection_name if no sets
-    if not coll_enrichments[0]:
+    if not coll_pipeline.stages:
         COLL['title'] = collection_name 
     set_ingested_date(COLL)
 
-    enriched_coll_text = pipe(COLL, ctype, coll_enrichments, 'HTTP_PIPELINE_COLL')
+    # Time spent in each stage during this request, by stage URI
+    timings = {}
+    enriched_coll_text = pipe(COLL, coll_pipeline, timings=timings, profiles=sampled())
     enriched_collection = json.loads(enriched_coll_text)
     # FIXME. Integrate collection storage into bulk call below
     if COUCH_DATABASE:
         docuri = join(COUCH_DATABASE,cid)
-        couch_rev_check_coll(docuri,enriched_collection)
+        if not initial_ingest:
+            couch_rev_check_coll(docuri,enriched_collection)
         resp, cont = H.request(docuri,'PUT',body=json.dumps(enriched_collection),headers=dict(CT_JSON.items()+COUCH_AUTH_HEADER.items()))
+        if resp.status == 409 and initial_ingest:
+            couch_rev_check_coll(docuri,enriched_collection)
+            resp, cont = H.request(docuri,'PUT',body=json.dumps(enriched_collection),headers=dict(CT_JSON.items()+COUCH_AUTH_HEADER.items()))
         if not str(resp.status).startswith('2'):
             logger.debug("Error storing collection in Couch: "+repr((resp,cont)))
 
-    # Then the records
-    docs = []
+    # Then the records, leaving out the ones unchanged since they were stored
+    records = []
+    record_hashes = []
+    record_subtrees = []
+    stored = {}
+    record_ids = [ r[u'id'] for r in data[u'items'] if u'id' in r ]
+    skip_unchanged = SKIP_UNCHANGED and request_headers.get('Skip-Unchanged','1') != '0'
+    if COUCH_DATABASE and skip_unchanged and record_ids and not initial_ingest:
+        stored = couch_fetch_hashes(source_name,record_ids)
     for record in data[u'items']:
-        # Preserve record prior to any enrichments
-        record['originalRecord'] = record.copy()         
+        rhash = record_hash(record,request_headers.get(u'Pipeline-Rec',''))
+        doc_id, rev, stored_hash = stored.get(record.get(u'id'),(None,None,None))
+        if doc_id:
+            # The rev came along with the hash, so the writer needn't look it up
+            REV_CACHE.put((source_name,doc_id),rev)
+        if stored_hash == rhash:
+            continue
+        records.append(record)
+        record_hashes.append(rhash)
+
+        # Preserve record prior to any enrichments. It and the other PASSTHROUGH
+        # subtrees are carried alongside the record rather than through every stage
+        original = record.copy()
+        subtrees = dict((key,record.pop(key)) for key in PASSTHROUGH if key in record)
+        if u'originalRecord' in PASSTHROUGH:
+            subtrees[u'originalRecord'] = original
+        else:
+            record[u'originalRecord'] = original
+        record_subtrees.append(subtrees)
 
         # Add collection information
         record[u'collection'] = {
@@ -138,16 +876,70 @@ def enrich(body,ctype):
         record[u'ingestType'] = 'item'
         set_ingested_date(record)
 
-        doc_text = pipe(record, ctype, rec_enrichments, 'HTTP_PIPELINE_REC')
-        doc = json.loads(doc_text)
-        docs.append(doc)
+    if len(records) < len(data[u'items']):
+        logger.debug("Skipping %d unchanged records"%(len(data[u'items'])-len(records)))
 
-    couch_rev_check_recs(docs,source_name)
-    couch_docs_text = json.dumps({"docs":docs})
-    if COUCH_DATABASE:
-        resp, content = H.request(join(COUCH_DATABASE,'_bulk_docs'),'POST',body=couch_docs_text,headers=dict(CT_JSON.items()+COUCH_AUTH_HEADER.items()))
-        logger.debug("Couch bulk update response: "+content)
-        if not str(resp.status).startswith('2'):
-            logger.debug('HTTP error posting to CouchDB: '+repr((resp,content)))
+    if BATCH_SIZE > 0:
+        tasks = [ (records[i:i+BATCH_SIZE], record_subtrees[i:i+BATCH_SIZE]) for i in xrange(0,len(records),BATCH_SIZE) ]
+        task_hashes = [ record_hashes[i:i+BATCH_SIZE] for i in xrange(0,len(records),BATCH_SIZE) ]
+        run = lambda (batch, detached): json.loads(pipe_batch(batch, rec_pipeline, detached, timings, sampled()))[u'items']
+    else:
+        tasks = [ ([record], [subtrees]) for record, subtrees in izip(records, record_subtrees) ]
+        task_hashes = [ [rhash] for rhash in record_hashes ]
+        run = lambda (batch, detached): [ json.loads(pipe(batch[0], rec_pipeline, detached[0], timings, sampled())) ]
 
+    # Workers can't call stages in-process, so they reach the ones mounted here
+    # over HTTP, which spreads the records over the server's processes
+    pool = ThreadPool(min(MAX_WORKERS,len(tasks))) if MAX_WORKERS > 1 and len(tasks) > 1 else None
+    rec_pipeline = Pipeline(rec_plan,request.environ,ctype,inprocess=pool is None)
+
+    # Callers which don't need the enriched docs back can ask for the ids of
+    # those stored instead, so that they needn't all be held until the request
+    # is done
+    writer = CouchBulkWriter(source_name,check_revs=not initial_ingest) if COUCH_DATABASE else None
+    return_docs = not writer or request_headers.get('Return-Docs','1') != '0'
+    docs = []
+    try:
+        # Both imaps yield results in task order, so output order is stable
+        for (batch, detached), hashes, result in izip(tasks, task_hashes, pool.imap(run, tasks) if pool else imap(run, tasks)):
+            for doc, subtrees, rhash in izip(result, detached, hashes):
+                doc.update(subtrees)
+                doc[u'originalRecordHash'] = rhash
+            if writer:
+                for doc in result:
+                    writer.add(doc)
+            if return_docs:
+                docs.extend(result)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if writer:
+        writer.flush()
+
+    # Records the provider has since deleted, as listed by an incremental harvest
+    if COUCH_DATABASE and data.get(u'deleted') and not initial_ingest:
+        couch_delete_records(source_name,data[u'deleted'])
+
+    save_stage_stats()
+    if profiles:
+        save_profiles(source_name,collection_name,profiles)
+    if SERVER_TIMING and timings:
+        response.add_header('Server-Timing',server_timing(coll_pipeline.plan.uris+rec_plan.uris,timings))
+    if not return_docs:
+        return json.dumps({'stored': writer.written, 'failed': writer.failed})
     return json.dumps({'docs' : docs})
+
+@simple_service('GET', 'http://purl.org/la/dp/enrich-stats', 'enrich-stats', 'application/json')
+def enrich_stats(source=None):
+    '''
+    Reports the calls made to each pipeline stage by all the server's
+    processes, by source and then stage URI: how many calls and records,
+    errors, bytes sent and received, and total/min/max/mean/percentile seconds
+    taken. The "source" parameter limits the report to one source
+    '''
+    save_stage_stats(force=True)
+    return json.dumps(dict(
+        (src, dict((uri, stats.summary()) for uri, stats in by_uri.iteritems()))
+        for src, by_uri in load_stage_stats().iteritems()
+        if source is None or src == source), indent=4)
@@ -2,12 +2,13 @@ import re
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import setprop, select, PATH_DELIM, WILDCARD
+from dplaingestion.batch import batch_service
 
 REGEXPS = ('\.',''), ('\(',''), ('\)',''), ('-',''), (',','')
 
-@simple_service('POST', 'http://purl.org/la/dp/enrich_location', 'enrich_location', 'application/json')
+@simple_service('POST', 'http://purl.org/la/dp/enrich_location', 'enrich_location', 'application/json', wsgi_wrapper=batch_service)
 def enrichlocation(body,ctype,action="enrich_location", prop="aggregatedCHO/spatial"):
     """
     Service that accepts a JSON document and enriches the "spatial" field of that document by
@@ -25,9 +26,10 @@ def enrichlocation(body,ctype,action="enrich_location", prop="aggregatedCHO/spat
         response.add_header('content-type', 'text/plain')
         return "Unable to parse body as JSON"
 
-    if exists(data,prop):
+    # The places in prop, whether it holds a list of them or just the one
+    v = [ ref.get() for ref in select(data,PATH_DELIM.join((prop,WILDCARD))) ]
+    if v:
         # Remove any spaces around semicolons first
-        v = getprop(data,prop)
         for k in v[0]:
             v[0][k] = remove_space_around_semicolons(v[0][k])
 
@@ -87,10 +89,9 @@ def get_isostate(strg, frm_abbrev=None):
         else:
             states = [strg_item]
         for state in states:
-            for st in STATES:
-                if st in state.upper():
-                    iso_arr.append(STATES[st])
-                    state_arr.append(st.title())
+            for st in find_states(state):
+                iso_arr.append(STATES[st])
+                state_arr.append(st.title())
 
     iso, state = None, None
     if iso_arr:
@@ -99,28 +100,29 @@ def get_isostate(strg, frm_abbrev=None):
             state = ';'.join(state_arr)
     return (iso, state)
 
+def find_states(strg):
+    """
+    Returns the STATES names found anywhere in strg, in STATES order
+    """
+    found = set(STATE_NAME_RE.findall(strg.upper()))
+    return sorted(found, key=STATE_ORDER.get)
+
 def from_abbrev(strg):
-    states = []
     for pattern, replace in REGEXPS:
         strg = re.sub(pattern, replace, strg)
-    # First check against STATES iso values, minus the "US-"
-    for state, iso in STATES.iteritems():
-        st = re.sub('US-','',iso)
-        match = re.compile(r'\b({0})\b'.format(st)).search(strg.upper())
-        if match:
-            s = match.group(0)
-            # Check against cases like "in"/"as"/etc
-            low = re.compile(r'\b({0})\b'.format(s.lower())).search(strg)
-            if not low:
-                states.append(state.title())
-    # If no matches, check againts the ABBREV values
+    # First check against STATES iso values, minus the "US-". Skip any
+    # also found in lower case, as in "in"/"as"/etc
+    found = set(STATE_CODE_RE.findall(strg.upper()))
+    found.difference_update(c.upper() for c in STATE_CODE_LOWER_RE.findall(strg))
+    states = [ st.title() for st in sorted(map(STATE_CODES.get, found), key=STATE_ORDER.get) ]
+    # If no matches, check againts the ABBREV values. States named in full
+    # are still found in strg by get_isostate, so it is kept alongside them
     if not states:
-        for state,abbrevs in ABBREV.iteritems():
-            for abbrev in abbrevs.split(';'):
-                match = re.compile(r'\b({0})\b'.format(abbrev)).search(strg.upper())
-                if match:
-                    states.append(state)
-                break
+        names = find_states(strg)
+        found = set(ABBREV_STATES[a] for a in ABBREV_RE.findall(strg.upper()))
+        states = [ state for state in ABBREV if state in found and state.upper() not in names ]
+        if states and names:
+            states.insert(0, strg)
     if not states:
         states.append(strg)
     return states
@@ -230,3 +232,15 @@ ABBREV = {
     "Pennsylvania": "PEN;PENN",
     "Massachusetts": "MASS"
 }
+
+# The tables above compiled into single patterns, each matching all the
+# entries it finds in one scan. No state name starts another, so the
+# lookahead finds names within names too, like "KANSAS" in "ARKANSAS"
+STATE_ORDER = dict((st, i) for i, st in enumerate(STATES))
+STATE_NAME_RE = re.compile(r'(?=(%s))' % '|'.join(map(re.escape, STATES)))
+STATE_CODES = dict((iso.replace('US-',''), st) for st, iso in STATES.iteritems())
+STATE_CODE_RE = re.compile(r'\b(%s)\b' % '|'.join(STATE_CODES))
+STATE_CODE_LOWER_RE = re.compile(r'\b(%s)\b' % '|'.join(STATE_CODES).lower())
+ABBREV_STATES = dict((abbrev, state) for state, abbrevs in ABBREV.iteritems()
+                     for abbrev in abbrevs.split(';'))
+ABBREV_RE = re.compile(r'\b(%s)\b' % '|'.join(ABBREV_STATES))
@@ -15,7 +15,7 @@ import copy
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 
 from dplaingestion.selector import getprop, setprop, PATH_DELIM
 
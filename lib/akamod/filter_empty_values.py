@@ -15,9 +15,10 @@ import copy
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 
 from dplaingestion.selector import getprop, setprop, PATH_DELIM
+from dplaingestion.batch import batch_service
 
 
 HTTP_INTERNAL_SERVER_ERROR = 500
@@ -28,34 +29,42 @@ HTTP_HEADER_TYPE = 'Content-Type'
 
 def filter_empty_leaves(d, ignore_keys=tuple()):
     """
-    Makes one iteration and removes found empty leaves from dictionary tree; (Empty leaf = key without value;)
+    Removes empty leaves from dictionary tree, along with the dictionaries and lists they leave empty; (Empty leaf = key without value;)
 
     Ignores keys listed in ignore_keys sequence;
     Returns: cleaned dictionary;
 
     Side effect: modifies passed dictionary!
     """
-    def sub_cleaner(el):
-        if isinstance(el, dict):
-            return filter_empty_leaves(copy.deepcopy(el), ignore_keys)
-        else:
-            return el
-
-    for k, v in d.items():
+    for k in d.keys():
         if k in ignore_keys:
             continue
-        elif isinstance(v, dict) and v:
-            d[k] = filter_empty_leaves(v, ignore_keys)
+        v = d[k]
+        if isinstance(v, dict) and v:
+            filter_empty_leaves(v, ignore_keys)
         elif isinstance(v, list) and v:
-            d[k] = [sub_cleaner(e) for e in v if e]
-        else:
-            if not v and k not in ignore_keys:
-                del d[k]
+            filter_list(v, ignore_keys)
+        if not v:
+            del d[k]
     return d
 
+def filter_list(l, ignore_keys=tuple()):
+    """
+    Removes empty elements from list, cleaning the dictionaries in it first; lists nested in it are kept as they are;
+    Side effect: modifies passed list!
+    """
+    kept = []
+    for e in l:
+        if isinstance(e, dict) and e:
+            filter_empty_leaves(e, ignore_keys)
+        if e:
+            kept.append(e)
+    l[:] = kept
+    return l
+
 def filter_fields(d, check_keys=tuple()):
     """
-    Makes one iteration and cleans found elements of dictionary with given keys if corresponding value is empty;
+    Cleans found elements of dictionary with given keys if corresponding value is empty, or is left empty by removing its empty leaves;
     Arguments:
      d - dictionary for traversing;
      check_keys - list of top-level keys to check;
@@ -64,52 +73,45 @@ def filter_fields(d, check_keys=tuple()):
     Side effect:
      modifies passed dictionary
     """
-    def sub_cleaner(el):
-        if isinstance(el, dict):
-            return filter_empty_leaves(copy.deepcopy(el))
-        else:
-            return el
-
-    for k, v in d.items():
+    for k in d.keys():
         if k not in check_keys:
             continue
-        elif isinstance(v, dict) and v:
-            d[k] = filter_empty_leaves(v)
+        v = d[k]
+        if isinstance(v, dict) and v:
+            filter_empty_leaves(v)
         elif isinstance(v, list) and v:
-            d[k] = [sub_cleaner(e) for e in v if e]
-        else:
-            if not v:
-                del d[k]
+            filter_list(v)
+        if not v:
+            del d[k]
     return d
 
 def filter_dict(_dict, cleaner_func, *args):
     """
-    Repeatedly runs cleaner function until all empty leaves are removed (hash stops changing).
+    Runs cleaner function against passed dictionary. The cleaners work bottom up, so a single run removes all empty leaves
+    and whatever they leave empty.
     Arguments:
      _dict - dictionary to clean;
      cleaner_func - runs given function against passed dictionary;
      *args - arguments will be passed to cleaner func
     Returns:
      cleaned dictionary
+    Side effect:
+     modifies passed dictionary
     """
-    d = copy.deepcopy(_dict)
-    hash_before = hash(str(d))
-    hash_current = None
-    while hash_before != hash_current:
-        hash_before = hash_current
-        hash_current = hash(str(cleaner_func(d, *args)))
-    return d
+    return cleaner_func(_dict, *args)
 
 def filter_path(_dict, path):
     """
-    Repeatedly runs cleaner function until all empty values are removed from given path (hash stops changing).
+    Removes empty values from given path.
     Arguments:
      _dict - dictionary to clean;
      path - a xpath-like path to the value, that must be checked
     Returns:
      cleaned dictionary
+    Side effect:
+     modifies passed dictionary
     """
-    d = copy.deepcopy(_dict)
+    d = _dict
     embracing_path, sep, value_key = path.rpartition(PATH_DELIM)
     try:
         dict_to_clean = getprop(d, embracing_path)
@@ -130,7 +132,7 @@ def test_filtering():
     filtered = filter_dict(copy.deepcopy(source), filter_empty_leaves)
     assert expected == filtered, "Expected dictionary does not equal to filtered"
 
-@simple_service('POST', 'http://purl.org/la/dp/filter_empty_values', 'filter_empty_values', HTTP_TYPE_JSON)
+@simple_service('POST', 'http://purl.org/la/dp/filter_empty_values', 'filter_empty_values', HTTP_TYPE_JSON, wsgi_wrapper=batch_service)
 def filter_empty_values_endpoint(body, ctype, ignore_key="dplaSourceRecord"):
     """
     Cleans empty leaves of given json tree;
@@ -151,7 +153,7 @@ def filter_empty_values_endpoint(body, ctype, ignore_key="dplaSourceRecord"):
     data = filter_dict(data, filter_empty_leaves, ignore_keys)
     return json.dumps(data)
 
-@simple_service('POST', 'http://purl.org/la/dp/filter_fields', 'filter_fields', HTTP_TYPE_JSON)
+@simple_service('POST', 'http://purl.org/la/dp/filter_fields', 'filter_fields', HTTP_TYPE_JSON, wsgi_wrapper=batch_service)
 def filter_fields_endpoint(body, ctype, keys):
     """
     Cleans elements of json with given keys if corresponding value is empty;
@@ -172,7 +174,7 @@ def filter_fields_endpoint(body, ctype, keys):
     data = filter_dict(data, filter_fields, check_keys)
     return json.dumps(data)
 
-@simple_service('POST', 'http://purl.org/la/dp/filter_paths', 'filter_paths', HTTP_TYPE_JSON)
+@simple_service('POST', 'http://purl.org/la/dp/filter_paths', 'filter_paths', HTTP_TYPE_JSON, wsgi_wrapper=batch_service)
 def filter_paths_endpoint(body, ctype, paths):
     """
     Cleans elements of json with given xpath-like path if corresponding value is empty;
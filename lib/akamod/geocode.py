@@ -1,20 +1,74 @@
 from akara import logger
+from akara import module_config
 
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion.batch import batch_service
+from dplaingestion.cache import LRUCache, SQLiteCache
+from dplaingestion import jsonio as json
 from zen.akamod import geolookup_service
 
 GEOLOOKUP = geolookup_service()
 
-def lookup_place(p):
+# Places geocoded by this process, and optionally by any process, so each
+# distinct place only goes to the geocoder once
+PLACE_CACHE = LRUCache(int(module_config().get('cache_size', 100000)))
+CACHE_DBFILE = module_config().get('cache_dbfile')
+PLACE_STORE = SQLiteCache(CACHE_DBFILE, module_config().get('cache_max_age')) if CACHE_DBFILE else None
+
+def geolookup(p):
     lu = GEOLOOKUP(p)
     if p in lu:
         return lu[p]
     else:
         return ""
 
-@simple_service('POST', 'http://purl.org/la/dp/geocode', 'geocode', 'application/json')
+def lookup_place(p):
+    if not isinstance(p, basestring):
+        return geolookup(p)
+    return PLACE_CACHE.lookup(p, geocode_place)
+
+def geocode_place(p):
+    stored = PLACE_STORE.get_many([p]) if PLACE_STORE else {}
+    if p in stored:
+        return stored[p]
+    coords = geolookup(p)
+    if PLACE_STORE:
+        PLACE_STORE.put_many([(p, coords)])
+    return coords
+
+def lookup_places(places):
+    """
+    Geocodes each of the distinct places among places that isn't cached
+    already, returning a dict of their coordinates. GEOLOOKUP only takes a
+    single place, so there is still one lookup per place not yet cached
+    """
+    places = set(p for p in places if p not in PLACE_CACHE)
+    found = PLACE_STORE.get_many(places) if PLACE_STORE and places else {}
+    looked_up = [ (p, geolookup(p)) for p in places if p not in found ]
+    if PLACE_STORE and looked_up:
+        PLACE_STORE.put_many(looked_up)
+    found.update(looked_up)
+    for p, coords in found.iteritems():
+        PLACE_CACHE.put(p, coords)
+    return found
+
+def prepare_batch(items, prop=None, **params):
+    """
+    Geocodes the distinct places of a whole batch of records up front, so
+    each goes to the geocoder once rather than once per record
+    """
+    places = []
+    for data in items:
+        v = data.get(prop) if isinstance(data, dict) else None
+        if isinstance(v, basestring):
+            places.append(v)
+        elif hasattr(v, '__iter__'):
+            places.extend(p for p in v if isinstance(p, basestring))
+    lookup_places(places)
+
+@simple_service('POST', 'http://purl.org/la/dp/geocode', 'geocode', 'application/json',
+                wsgi_wrapper=lambda app: batch_service(app, prepare=prepare_batch))
 def geocode(body,ctype,prop=None,newprop=None):
     '''   
     Service that accepts a JSON document and "unshreds" the value of the
@@ -7,7 +7,8 @@ __author__ = 'aleksey'
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion.batch import batch_service
+from dplaingestion import jsonio as json
 from akara import module_config
 
 from dplaingestion import selector
@@ -22,7 +23,7 @@ HTTP_TYPE_TEXT = 'text/plain'
 HTTP_HEADER_TYPE = 'Content-Type'
 
 
-@simple_service('POST', 'http://purl.org/la/dp/georgia_identify_object', 'georgia_identify_object', HTTP_TYPE_JSON)
+@simple_service('POST', 'http://purl.org/la/dp/georgia_identify_object', 'georgia_identify_object', HTTP_TYPE_JSON, wsgi_wrapper=batch_service)
 def georgia_identify_object(body, ctype, download="True"):
 
     try:
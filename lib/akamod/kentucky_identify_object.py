@@ -2,15 +2,16 @@ import os
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
 from akara import module_config
 
 IGNORE = module_config().get('IGNORE')
 PENDING = module_config().get('PENDING')
 
 @simple_service('POST', 'http://purl.org/la/dp/kentucky_identify_object',
-    'kentucky_identify_object', 'application/json')
+    'kentucky_identify_object', 'application/json', wsgi_wrapper=batch_service)
 def kentucky_identify_object(body, ctype, rights_field="aggregatedCHO/rights", download="True"):
     """
     Responsible for: adding a field to a document with the URL where we
@@ -34,9 +35,8 @@ def kentucky_identify_object(body, ctype, rights_field="aggregatedCHO/rights", d
         return msg
 
     relation_field = "aggregatedCHO/relation"
-    if exists(data, relation_field):
-        url = getprop(data, relation_field)
-    else:
+    url = getprop_or_default(data, relation_field)
+    if url is None:
         msg = "Field %s does not exist" % relation_field
         logger.error(msg)
         return body
@@ -44,9 +44,7 @@ def kentucky_identify_object(body, ctype, rights_field="aggregatedCHO/rights", d
     base_url, ext = os.path.splitext(url)  
     thumb_url = "%s_tb%s" % (base_url, ext)
 
-    rights = None
-    if exists(data, rights_field):
-        rights = getprop(data, rights_field)
+    rights = getprop_or_default(data, rights_field)
 
     data["object"] = {"@id": thumb_url, "format": "", "rights": rights}
 
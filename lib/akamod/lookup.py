@@ -2,7 +2,9 @@ from akara import logger
 from akara import module_config
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
+from dplaingestion.batch import batch_service
+from dplaingestion.selector import select
+from dplaingestion import jsonio as json
 
 
 def convert_last(data, path, name, conv):
@@ -54,7 +56,7 @@ def convert_last(data, path, name, conv):
         data[name] = conv[value]
 
 
-def convert(data, path, name, conv, path_delim="/"):
+def convert(data, path, name, conv):
     """ Converts data using converters.
 
     Args:
@@ -74,45 +76,13 @@ def convert(data, path, name, conv, path_delim="/"):
     Raises:
         Nothing
 
-    This function is called recursively. Inspired by the setprop from selector
-    module.
-
-    Each call the path is stripped by one element.
-
-    If the data argumetn is a dictionary, then data[path_part] is passed to
-    the next recursive call.
-
-    If the data is a list, then the function is called for each element.
+    The dictionaries holding the value are found with selector.select, which
+    goes through any lists along the path to each dictionary in them. Each
+    of them is then converted with convert_last.
 
     """
-    # So we should convert now
-    if not path_delim in path:
-        # There is a list to convert.
-        # If there is a list of dictionaries, each dictionary has to be
-        # converted.
-        if isinstance(data, list):
-            for el in data:
-                convert_last(el, path, name, conv)
-        else:
-            convert_last(data, path, name, conv)
-
-        return
-
-    # If there is deeper path, let's check it
-    pp, pn = tuple(path.lstrip(path_delim).split(path_delim, 1))
-
-    # For list: iterate over elements
-    if isinstance(data, list):
-        for el in data:
-            convert(el, path, name, conv)
-    elif isinstance(data, dict):
-        if pp not in data:
-            # Then just do nothing
-            logger.error("Couldn't find {0} in data.".format(pp))
-        else:
-            convert(data[pp], pn, name, conv)
-    else:
-        logger.error("Got data of unknown type")
+    for ref in select(data, path):
+        convert_last(ref.container, ref.key, name, conv)
 
 
 def find_conversion_dictionary(mapping_key):
@@ -163,7 +133,7 @@ def the_same_beginning(prop, target):
         or (prop.split("/")[:-1] == target.split("/")[:-1])
 
 
-@simple_service('POST', 'http://purl.org/la/dp/lookup', 'lookup', 'application/json')
+@simple_service('POST', 'http://purl.org/la/dp/lookup', 'lookup', 'application/json', wsgi_wrapper=batch_service)
 def lookup(body, ctype, prop, target, substitution):
     """ Performs simple lookup.
 
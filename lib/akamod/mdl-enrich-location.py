@@ -1,10 +1,11 @@
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
 
-@simple_service('POST', 'http://purl.org/la/dp/mdl-enrich-location', 'mdl-enrich-location', 'application/json')
+@simple_service('POST', 'http://purl.org/la/dp/mdl-enrich-location', 'mdl-enrich-location', 'application/json', wsgi_wrapper=batch_service)
 def mdlenrichlocation(body,ctype,action="mdl-enrich-location", prop="aggregatedCHO/spatial"):
     """
     Service that accepts a JSON document and enriches the "spatial" field of that document by:
@@ -23,9 +24,9 @@ def mdlenrichlocation(body,ctype,action="mdl-enrich-location", prop="aggregatedC
         response.add_header('content-type', 'text/plain')
         return "Unable to parse body as JSON"
 
-    if exists(data,prop):
+    v = getprop_or_default(data,prop)
+    if v is not None:
         sp = {}
-        v = getprop(data,prop)
         fields = len(v)
         if not fields:
             logger.error("Spatial is empty.")
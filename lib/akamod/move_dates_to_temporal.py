@@ -1,11 +1,12 @@
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, delprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import getprop_or_default, setprop, delprop, exists, select, PATH_DELIM, WILDCARD
+from dplaingestion.batch import batch_service
 import re
 
-@simple_service('POST', 'http://purl.org/la/dp/move_dates_to_temporal', 'move_dates_to_temporal', 'application/json')
+@simple_service('POST', 'http://purl.org/la/dp/move_dates_to_temporal', 'move_dates_to_temporal', 'application/json', wsgi_wrapper=batch_service)
 def movedatestotemporal(body,ctype,action="move_dates_to_temporal",prop=None):
     """
     Service that accepts a JSON document and moves any dates found in the prop field to the
@@ -34,9 +35,11 @@ def movedatestotemporal(body,ctype,action="move_dates_to_temporal",prop=None):
     if exists(data, prop):
         p = []
         temporal_field = "aggregatedCHO/temporal"
-        temporal = getprop(data, temporal_field) if exists(data, temporal_field) else []
+        temporal = getprop_or_default(data, temporal_field, [])
 
-        for d in getprop(data, prop):
+        # prop may hold a list of places or just the one
+        for ref in select(data, PATH_DELIM.join((prop, WILDCARD))):
+            d = ref.get()
             for regsearch in REGSEARCH:
                 pattern = re.compile(regsearch)
                 for match in pattern.findall(d["name"]):
@@ -1,8 +1,49 @@
 import sys
+from urlparse import urlsplit, parse_qs
 from akara.services import simple_service
 from akara import request, response
 from akara import logger
-from amara.thirdparty import json, httplib2
+from akara import module_config
+from amara.thirdparty import httplib2
+from dplaingestion.cache import SQLiteCache
+from dplaingestion import jsonio as json
+
+# Set listings are kept in an SQLite file shared by every process using it,
+# and filled by dpla-list-sets whenever it lists a provider's sets; see the
+# oai_sets section of akara.conf
+SETS_CONFIG = module_config('oai_sets')
+SETS_DBFILE = SETS_CONFIG.get('cache_dbfile')
+SETS_STORE = SQLiteCache(SETS_DBFILE, SETS_CONFIG.get('cache_max_age', 3600)) if SETS_DBFILE else None
+
+def sets_key(sets_service):
+    """
+    Returns the key dpla-list-sets stores the listing of sets_service under,
+    i.e. its OAI endpoint
+    """
+    query = parse_qs(urlsplit(sets_service).query)
+    return query['endpoint'][0] if 'endpoint' in query else sets_service
+
+def fetch_sets(sets_service):
+    H = httplib2.Http('/tmp/.cache')
+    H.force_exception_as_status_code = True
+    resp, content = H.request(sets_service)
+    if not resp[u'status'].startswith('2'):
+         print >> sys.stderr, '  HTTP error ('+resp[u'status']+') resolving URL: '+sets_service
+    return content
+
+def list_sets(sets_service, store=None, fetch=fetch_sets):
+    """
+    Returns the listing of sets_service from store if it's there, or else as
+    fetched from it. Raises ValueError if what's fetched isn't JSON
+    """
+    stored = store.get_many([sets_key(sets_service)]) if store else {}
+    if stored:
+        return stored.values()[0]
+    content = fetch(sets_service)
+    try :
+        return json.loads(content)
+    except:
+        raise ValueError("Unable to parse sets service result as JSON: " + repr(content))
 
 @simple_service('POST', 'http://purl.org/la/dp/oai-set-name', 'oai-set-name', 'application/json')
 def oaisetname(body,ctype,sets_service=None):
@@ -32,23 +73,17 @@ def oaisetname(body,ctype,sets_service=None):
         response.add_header('content-type','text/plain')
         return "No Collection header found"
 
-    H = httplib2.Http('/tmp/.cache')
-    H.force_exception_as_status_code = True
-    resp, content = H.request(sets_service)
-    if not resp[u'status'].startswith('2'):
-         print >> sys.stderr, '  HTTP error ('+resp[u'status']+') resolving URL: '+sets_service
-
     try :
-        sets = json.loads(content)
-    except:
+        sets = list_sets(sets_service, SETS_STORE)
+    except ValueError as e:
         response.code = 500
         response.add_header('content-type','text/plain')
-        return "Unable to parse sets service result as JSON: " + repr(content)
+        return str(e)
 
     for s in sets:
         if s['setSpec'] == collection:
              data[u'title'] = s['setName']
-             if s['setDescription']:
+             if s.get('setDescription'):
                  data[u'description'] = s['setDescription']
              break
 
@@ -1,8 +1,9 @@
 from akara import logger
 from akara import request, response
 from akara.services import simple_service
+from dplaingestion.batch import batch_service
 from amara.lib.iri import is_absolute
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 from functools import partial
 import base64
 import sys
@@ -99,7 +100,7 @@ AGGREGATION_TRANSFORMER = {
     "ingestDate"       : lambda d: {"ingestDate": d.get("ingestDate",None)}
 }
 
-@simple_service('POST', 'http://purl.org/la/dp/oai-to-dpla', 'oai-to-dpla', 'application/ld+json')
+@simple_service('POST', 'http://purl.org/la/dp/oai-to-dpla', 'oai-to-dpla', 'application/ld+json', wsgi_wrapper=batch_service)
 def oaitodpla(body,ctype,geoprop=None):
     '''   
     Convert output of Freemix OAI service into the DPLA JSON-LD format.
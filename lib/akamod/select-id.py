@@ -1,15 +1,16 @@
 import hashlib
-from amara.thirdparty import json
+from dplaingestion import jsonio as json
 from amara.lib.iri import is_absolute
 from akara.services import simple_service
 from akara.util import copy_headers_to_dict
 from akara import request, response, logger
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
 
 COUCH_ID_BUILDER = lambda src, lname: "--".join((src,lname))
 COUCH_REC_ID_BUILDER = lambda src, id_handle: COUCH_ID_BUILDER(src,id_handle.strip().replace(" ","__"))
 
-@simple_service('POST', 'http://purl.org/la/dp/select-id', 'select-id', 'application/json')
+@simple_service('POST', 'http://purl.org/la/dp/select-id', 'select-id', 'application/json', wsgi_wrapper=batch_service)
 def selid(body,ctype,prop='handle'):
     '''   
     Service that accepts a JSON document and adds or sets the "id" property to the
@@ -32,8 +33,8 @@ def selid(body,ctype,prop='handle'):
     source_name = request_headers.get('Source')
 
     id = None
-    if exists(data,prop):
-        v = getprop(data,prop)
+    v = getprop_or_default(data,prop)
+    if v is not None:
         if isinstance(v,basestring):
             id = v
         else:
@@ -1,10 +1,11 @@
 from akara import logger
 from akara import response
 from akara.services import simple_service
-from amara.thirdparty import json
-from dplaingestion.selector import getprop, setprop, exists
+from dplaingestion import jsonio as json
+from dplaingestion.selector import getprop_or_default, setprop
+from dplaingestion.batch import batch_service
 
-@simple_service('POST', 'http://purl.org/la/dp/shred', 'shred', 'application/json')
+@simple_service('POST', 'http://purl.org/la/dp/shred', 'shred', 'application/json', wsgi_wrapper=batch_service)
 def shred(body,ctype,action="shred",prop=None,delim=';'):
     '''   
     Service that accepts a JSON document and "shreds" or "unshreds" the value
@@ -23,8 +24,8 @@ def shred(body,ctype,action="shred",prop=None,delim=';'):
         return "Unable to parse body as JSON"
 
     for p in prop.split(','):
-        if exists(data,p):
-            v = getprop(data,p)
+        v = getprop_or_default(data,p)
+        if v is not None:
             if action == "shred":
                 if isinstance(v,list):
                     v = delim.join(v)
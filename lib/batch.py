@@ -0,0 +1,77 @@
+"""
+Batch contract for record-level enrichment services.
+
+A service registered with wsgi_wrapper=batch_service keeps accepting a
+single JSON record per POST, but when the request carries a
+"Pipeline-Batch" header the body is instead read as {"items": [...]}.
+Each item is run through the service on its own and the transformed
+items are returned as {"items": [...]} in the same order. Items the
+service rejects are returned unchanged, the same as a failed stage in
+the enrich pipeline. Batch responses carry the "Pipeline-Batch" header
+so callers can tell them from services unaware of the contract.
+
+A service can also pass batch_service a prepare function, which is given
+the batch's items and the service's query parameters before any item is
+run, e.g. to look up everything the batch needs in one go.
+"""
+
+from cStringIO import StringIO
+import cgi
+
+from akara import logger
+from dplaingestion import jsonio as json
+
+BATCH_HEADER = 'Pipeline-Batch'
+BATCH_ENVIRON = 'HTTP_PIPELINE_BATCH'
+
+def batch_service(app, prepare=None):
+    """
+    WSGI wrapper, for use as the wsgi_wrapper argument of simple_service
+    """
+    def wrapper(environ, start_response):
+        if not environ.get(BATCH_ENVIRON):
+            return app(environ, start_response)
+
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            items = json.loads(environ['wsgi.input'].read(length))[u'items']
+        except Exception as e:
+            start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+            return ["Unable to parse body as a JSON batch: %r" % e]
+
+        if prepare:
+            params = dict((k, v[-1]) for k, v in
+                          cgi.parse_qs(environ.get('QUERY_STRING', '')).items())
+            try:
+                prepare(items, **params)
+            except Exception:
+                logger.exception("Uncaught exception preparing batch at %s"%environ.get('PATH_INFO'))
+
+        item_environ = environ.copy()
+        del item_environ[BATCH_ENVIRON]
+        out = []
+        for item in items:
+            body = json.dumps(item)
+            item_environ.update({
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': StringIO(body)
+            })
+            status = []
+            def item_response(code, headers, exc_info=None):
+                status.append(code)
+            try:
+                result = ''.join(app(item_environ.copy(), item_response))
+            except Exception:
+                logger.exception("Uncaught exception for batch item at %s"%environ.get('PATH_INFO'))
+                result = None
+            # Responses are already JSON text, so splice them in as is
+            out.append(result if result and status and status[0].startswith('2') else body)
+
+        body = '{"items": [' + ', '.join(out) + ']}'
+        start_response('200 OK', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            (BATCH_HEADER, 'true')
+        ])
+        return [body]
+    return wrapper
@@ -0,0 +1,177 @@
+"""
+Bounded caches for values that are costly to work out and asked for again
+and again, like the parse of a date string or the geocode of a place name
+"""
+from collections import OrderedDict
+from dplaingestion import jsonio as json
+import sqlite3
+import threading
+import time
+
+class LRUCache(object):
+    """
+    Remembers up to max_size computed values, dropping the least recently
+    used one to make room, and counts the lookups it could and couldn't
+    answer
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, compute):
+        """
+        Returns the value cached for key, calling compute(key) and caching
+        the result if there isn't one
+        """
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.items[key] = value
+                return value
+        value = compute(key)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        if self.max_size > 0:
+            with self.lock:
+                self.items.pop(key, None)
+                self.items[key] = value
+                while len(self.items) > self.max_size:
+                    self.items.popitem(last=False)
+
+    def get(self, key, default=None):
+        """
+        Returns the value cached for key, or default if there isn't one
+        """
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return default
+            self.items[key] = value
+            return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.items.pop(key, default)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return {u'size': len(self.items), u'max_size': self.max_size,
+                u'hits': self.hits, u'misses': self.misses}
+
+class SQLiteCache(object):
+    """
+    Computed values kept in an SQLite file, so they outlive the process and
+    are shared by every process using the file. Values older than max_age
+    seconds (if given) are ignored, their age going by clock. Values are
+    stored as JSON.
+    """
+    def __init__(self, path, max_age=None, clock=time.time):
+        self.max_age = max_age
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS cache "
+                            "(key TEXT PRIMARY KEY, value TEXT, stored REAL)")
+
+    def get_many(self, keys):
+        """
+        Returns a dict of the values stored for those of keys that have one
+        """
+        oldest = self.clock() - self.max_age if self.max_age else 0
+        found = {}
+        keys = list(keys)
+        with self.lock:
+            # Within SQLite's limit on the number of parameters
+            for i in xrange(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                rows = self.db.execute(
+                    "SELECT key, value FROM cache WHERE stored >= ? AND key IN (%s)"
+                    % ','.join('?' * len(chunk)), [oldest] + chunk)
+                for key, value in rows:
+                    found[key] = json.loads(value)
+        return found
+
+    def put_many(self, items):
+        """
+        Stores the (key, value) pairs of items
+        """
+        now = self.clock()
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                    [ (key, json.dumps(value), now) for key, value in items ])
+
+def test_lru_cache():
+    computed = []
+    def compute(key):
+        computed.append(key)
+        return key.upper()
+    cache = LRUCache(2)
+    assert cache.lookup('a', compute) == 'A'
+    assert cache.lookup('b', compute) == 'B'
+    assert cache.lookup('a', compute) == 'A'
+    # 'b' is now the least recently used, so it goes
+    assert cache.lookup('c', compute) == 'C'
+    assert cache.lookup('a', compute) == 'A'
+    assert cache.lookup('b', compute) == 'B'
+    assert computed == ['a', 'b', 'c', 'b']
+    assert cache.stats() == {'size': 2, 'max_size': 2, 'hits': 2, 'misses': 4}
+    cache.clear()
+    assert cache.stats() == {'size': 0, 'max_size': 2, 'hits': 0, 'misses': 0}
+
+def test_lru_cache_disabled():
+    cache = LRUCache(0)
+    assert cache.lookup('a', len) == 1
+    assert cache.lookup('a', len) == 1
+    assert cache.stats()['misses'] == 2
+
+def test_lru_cache_put():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('a', 3)
+    cache.put('c', 4)
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+    assert cache.lookup('a', len) == 3
+
+def test_lru_cache_get_pop():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', None)
+    assert cache.get('b', 0) is None and cache.get('c', 0) == 0
+    assert cache.get('a') == 1
+    # 'a' was used last, so 'b' goes
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.pop('a') == 1 and cache.pop('a') is None
+    assert cache.stats()['size'] == 1
+
+def test_sqlite_cache():
+    import os, tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'cache.sqlite3')
+    cache = SQLiteCache(path)
+    cache.put_many([(u'South Carolina', u'34,-81'), (u'Nowhere', u'')])
+    assert SQLiteCache(path).get_many([u'South Carolina', u'Nowhere', u'Texas']) == \
+        {u'South Carolina': u'34,-81', u'Nowhere': u''}
+    assert SQLiteCache(path).get_many([]) == {}
+    time.sleep(0.01)
+    assert SQLiteCache(path, max_age=0.001).get_many([u'Nowhere']) == {}
@@ -0,0 +1,184 @@
+"""
+Helpers for harvesting from remote providers
+"""
+from multiprocessing.pool import ThreadPool
+from dplaingestion import jsonio as json
+import os
+import threading
+import time
+
+STOP = object()
+
+def prefetch(iterable):
+    """
+    Yields the items of iterable, fetching each one in a background thread
+    while the one before it is being consumed
+    """
+    it = iter(iterable)
+    pool = ThreadPool(1)
+    try:
+        pending = pool.apply_async(next, (it, STOP))
+        while True:
+            item = pending.get()
+            if item is STOP:
+                break
+            pending = pool.apply_async(next, (it, STOP))
+            yield item
+    finally:
+        pool.close()
+        pool.join()
+
+class RateLimiter(object):
+    """
+    Spaces out requests so that no host gets more than a given number per
+    second, however many threads are making them
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, host, rate):
+        """
+        Blocks until a request to host can be made at rate requests per
+        second. A rate of 0 (or None) doesn't limit requests
+        """
+        if not rate:
+            return
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot.get(host, 0))
+            self.next_slot[host] = slot + 1.0/rate
+        if slot > now:
+            time.sleep(slot - now)
+
+class Journal(object):
+    """
+    Progress of the harvest of a profile's sets, appended to a JSON-lines
+    file as each page is enriched so an interrupted harvest can pick up
+    from the last page that made it. Each line gives a set, the resumption
+    token for its next page, the number of pages done and whether the set
+    is finished.
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sets = {}
+        line = '\n'
+        if resume and os.path.exists(path):
+            for line in open(path):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Cut short by whatever stopped the last run
+                    continue
+                self.sets[entry[u'set']] = entry
+        self.f = open(path, 'a' if resume else 'w')
+        if not line.endswith('\n'):
+            self.f.write('\n')
+
+    def get(self, set):
+        """
+        Returns the last entry recorded for set, or None
+        """
+        return self.sets.get(set)
+
+    def record(self, set, resumption_token, pages, done=False):
+        entry = {u'set': set, u'resumption_token': resumption_token,
+                 u'pages': pages, u'done': done}
+        with self.lock:
+            self.sets[set] = entry
+            self.f.write(json.dumps(entry) + '\n')
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def all_done(self):
+        """
+        Returns whether every set journaled has been harvested in full
+        """
+        return all(entry[u'done'] for entry in self.sets.itervalues())
+
+    def close(self, finished=False):
+        """
+        Closes the journal, removing it if the whole harvest finished
+        """
+        self.f.close()
+        if finished:
+            os.remove(self.path)
+
+def test_prefetch():
+    assert list(prefetch(xrange(5))) == range(5)
+    assert list(prefetch([])) == []
+
+def test_prefetch_runs_ahead():
+    fetched = []
+    handled = threading.Event()
+    def pages():
+        fetched.append(0)
+        yield 0
+        fetched.append(1)
+        yield 1
+        # Not asked for until page 0 has been handled
+        assert handled.is_set()
+    it = prefetch(pages())
+    assert it.next() == 0
+    for _ in xrange(100):
+        if len(fetched) == 2:
+            break
+        time.sleep(0.01)
+    assert fetched == [0, 1]
+    handled.set()
+    assert list(it) == [1]
+
+def test_prefetch_raises():
+    def pages():
+        yield 1
+        raise ValueError('page 2')
+    it = prefetch(pages())
+    assert it.next() == 1
+    try:
+        it.next()
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_rate_limiter():
+    limiter = RateLimiter()
+    start = time.time()
+    for i in xrange(3):
+        limiter.wait('a', 20)
+    # Other hosts aren't held up by 'a'
+    limiter.wait('b', 20)
+    limiter.wait('c', 0)
+    elapsed = time.time() - start
+    assert 0.1 <= elapsed < 0.15, elapsed
+
+def test_journal():
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'p.journal')
+    journal = Journal(path)
+    journal.record('a', 'tok1', 1)
+    journal.record('b', '', 3, done=True)
+    journal.record('a', 'tok2', 2)
+    journal.close()
+    open(path, 'a').write('{"set": "a", "resump')
+
+    journal = Journal(path, resume=True)
+    assert not journal.all_done()
+    assert journal.get('a')['resumption_token'] == 'tok2'
+    assert journal.get('a')['pages'] == 2
+    assert journal.get('b')['done']
+    assert journal.get('c') is None
+    journal.record('c', 'tok1', 1)
+    journal.record('a', '', 3, done=True)
+    journal.record('c', '', 2, done=True)
+    assert journal.all_done()
+    journal.close()
+    assert Journal(path, resume=True).get('c')['pages'] == 2
+
+    Journal(path, resume=True).close(finished=True)
+    assert not os.path.exists(path)
+
+    # Without resume, earlier progress is dropped
+    Journal(path).close()
+    assert Journal(path, resume=True).get('a') is None
@@ -0,0 +1,55 @@
+"""
+The JSON codec used by the ingestion services and scripts. Records are
+decoded and encoded several times each on their way through the pipeline,
+so the fastest decoder and encoder available are picked at import, as
+long as they give the same results as the standard library's json module:
+the same values when decoding, and the same text, byte for byte, when
+encoding.
+
+simplejson's C decoder is used when it is installed, as it decodes
+a good deal faster than the standard library (it gives str rather than
+unicode for ASCII-only strings, which compare and encode the same). The
+standard library's C encoder is faster than simplejson's, so it does the
+encoding unless it is missing.
+"""
+import json as stdlib_json
+
+try:
+    import simplejson
+    if not simplejson._import_c_make_encoder() or not simplejson.decoder.c_scanstring:
+        # Without its speedups simplejson is slower than the standard library
+        simplejson = None
+except ImportError:
+    simplejson = None
+
+if simplejson:
+    DECODER = 'simplejson'
+    _decoder = simplejson.JSONDecoder()
+
+    def loads(s, **kw):
+        if kw:
+            return simplejson.loads(s, **kw)
+        return _decoder.decode(s)
+else:
+    DECODER = 'json'
+    loads = stdlib_json.loads
+
+if stdlib_json.encoder.c_make_encoder or not simplejson:
+    ENCODER = 'json'
+    dumps = stdlib_json.dumps
+else:
+    ENCODER = 'simplejson'
+
+    def dumps(obj, **kw):
+        # simplejson leaves the space out after commas at the end of
+        # indented lines, and would encode decimals as numbers
+        if kw.get('indent') is not None:
+            kw.setdefault('separators', (', ', ': '))
+        kw.setdefault('use_decimal', False)
+        return simplejson.dumps(obj, **kw)
+
+def load(fp, **kw):
+    return loads(fp.read(), **kw)
+
+def dump(obj, fp, **kw):
+    fp.write(dumps(obj, **kw))
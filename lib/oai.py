@@ -18,6 +18,7 @@ from amara.lib import U
 from amara.pushtree import pushtree
 from amara.thirdparty import httplib2
 from akara import logger
+from dplaingestion.harvest import prefetch
 
 OAI_NAMESPACE = u"http://www.openarchives.org/OAI/2.0/"
 
@@ -130,14 +131,20 @@ class oaiservice(object):
 
         resource = resources[first_id]
 
-    def list_records(self, set="", resumption_token = ""):
+    def list_records(self, set="", resumption_token = "", from_date=None, until_date=None):
         '''
-        List records. Use either the resumption token or set id.
+        List records. Use either the resumption token or set id, optionally
+        limited to records changed from and/or until the given datestamps.
+        Records the repository reports as deleted are listed by id only.
         '''
         if resumption_token:
             params = {'verb' : 'ListRecords', 'resumptionToken': resumption_token}
         else:
             params = {'verb' : 'ListRecords', 'metadataPrefix': 'oai_dc', 'set': set}
+            if from_date:
+                params['from'] = from_date
+            if until_date:
+                params['until'] = until_date
         qstr = urllib.urlencode(params)
         url = self.root + '?' + qstr
         self.logger.debug('OAI request URL: {0}'.format(url))
@@ -145,18 +152,67 @@ class oaiservice(object):
         resp, content = self.h.request(url)
         retrieved_t = time.time()
         self.logger.debug('Retrieved in {0}s'.format(retrieved_t - start_t))
-        doc = bindery.parse(url, model=OAI_LISTRECORDS_MODEL)
-
-        records, first_id = metadata_dict(generate_metadata(doc),
-                                          nesteddict=False)
-        for id_, props in records:
-            for k, v in props.iteritems():
-                props[k] = [ U(item) for item in v ]
-        if (doc.OAI_PMH.ListRecords is not None) and (doc.OAI_PMH.ListRecords.resumptionToken is not None):
-            resumption_token = U(doc.OAI_PMH.ListRecords.resumptionToken)
-        else:
-            resumption_token = ''
-        return {'records' : records, 'resumption_token' : resumption_token}
+
+        # Records are pulled out of the page already fetched one at a time,
+        # rather than parsing the whole page (again) into a bindery document
+        records = []
+        by_id = {}
+        deleted = []
+        tokens = []
+        def receive_nodes(n):
+            if n.xml_local == u'resumptionToken':
+                tokens.append(U(n))
+                return
+            if n.xml_local != u'record':
+                return
+            id_ = U(n.xml_select(u'string(o:header/o:identifier)', prefixes=PREFIXES))
+            if n.xml_select(u'string(o:header/@status)', prefixes=PREFIXES) == u'deleted':
+                deleted.append(id_)
+                return
+            if id_ not in by_id:
+                by_id[id_] = {}
+                records.append((id_, by_id[id_]))
+            props = by_id[id_]
+            for datestamp in n.xml_select(u'o:header/o:datestamp', prefixes=PREFIXES):
+                props.setdefault(u'datestamp', []).append(U(datestamp))
+            for e in n.xml_select(u'o:metadata/oai_dc:dc/dc:*', prefixes=PREFIXES):
+                prop = OAI_DC_PROPERTIES.get(e.xml_local)
+                if prop:
+                    props.setdefault(prop, []).append(U(e))
+
+        pushtree(content, u"o:OAI-PMH/o:ListRecords/*", receive_nodes, namespaces=PREFIXES)
+        resumption_token = tokens[0] if tokens else ''
+        return {'records' : records, 'deleted' : deleted, 'resumption_token' : resumption_token}
+
+    def iter_pages(self, set="", from_date=None, until_date=None):
+        '''
+        Generate list_records results for a set, following resumption tokens
+        '''
+        result = self.list_records(set=set, from_date=from_date, until_date=until_date)
+        yield result
+        while result['resumption_token']:
+            result = self.list_records(resumption_token=result['resumption_token'])
+            yield result
+
+    def iter_records(self, set="", prefetch_pages=True, from_date=None, until_date=None):
+        '''
+        Generate the (id, properties) records of a set across all its pages.
+        The next page is requested while the records of the current one are
+        being consumed, unless prefetch_pages is False.
+        '''
+        pages = self.iter_pages(set, from_date, until_date)
+        for page in (prefetch(pages) if prefetch_pages else pages):
+            for record in page['records']:
+                yield record
+
+# Properties taken from the oai_dc elements of each ListRecords record, by
+# element name. These are the ones marked up in OAI_LISTRECORDS_XML below
+OAI_DC_PROPERTIES = dict( (name, name) for name in (
+    u'title', u'creator', u'subject', u'description', u'date', u'type',
+    u'audience', u'format', u'coverage', u'source', u'publisher',
+    u'contributor', u'provenance', u'accrualmethod', u'instructionalmethod',
+    u'rightsholder', u'rights', u'language', u'relation') )
+OAI_DC_PROPERTIES[u'identifier'] = u'handle'
 
 #
 OAI_LISTSETS_XML = """<?xml version="1.0" encoding="UTF-8"?>
@@ -273,5 +329,4 @@ OAI_GETRECORD_XML = """<?xml version="1.0" encoding="UTF-8"?>
 """
 
 OAI_GETRECORD_MODEL = examplotron_model(OAI_GETRECORD_XML)
-OAI_LISTRECORDS_MODEL = examplotron_model(OAI_LISTRECORDS_XML)
 
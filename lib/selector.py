@@ -2,72 +2,208 @@ import copy
 
 PATH_DELIM = '/'
 
-def getprop(obj,path,keyErrorAsNone=False):
+class CompiledPath(object):
     """
-    Returns the value of the key identified by interpreting
-    the path as a delimited hierarchy of keys
+    A delimited path split into its keys once, so that it can be applied to
+    many objects without reparsing it. Get one through compile_path
     """
-    if '/' not in path:
+    __slots__ = ('path','parents','leaf')
+
+    def __init__(self,path):
+        self.path = path
+        keys = path.split(PATH_DELIM)
+        # Empty keys before the last are skipped, as leading delimiters are
+        self.parents = tuple(k for k in keys[:-1] if k)
+        self.leaf = keys[-1]
+
+    def parent(self,obj,keyErrorAsNone=False):
+        """
+        Returns the object holding the last key, or None if it isn't
+        there and keyErrorAsNone
+        """
+        for key in self.parents:
+            if key not in obj:
+                if not keyErrorAsNone:
+                    raise KeyError('Path not found in object: %s (%s)'%(self.path,key))
+                return None
+            obj = obj[key]
+        return obj
+
+    def get(self,obj,keyErrorAsNone=False):
+        obj = self.parent(obj,keyErrorAsNone)
         if keyErrorAsNone:
-            return obj.get(path)
-        else:
-            return obj[path]
+            return obj.get(self.leaf) if obj is not None else None
+        return obj[self.leaf]
+
+    def get_or_default(self,obj,default=None):
+        """
+        Returns the value at the path, or default if the path isn't there or
+        holds None, like get if exists would be True, but in a single walk
+        """
+        obj = self.parent(obj,True)
+        if obj is None or obj.get(self.leaf) is None:
+            return default
+        return obj[self.leaf]
+
+    def set(self,obj,val,keyErrorAsNone=False):
+        obj = self.parent(obj,keyErrorAsNone)
+        if obj is not None:
+            obj[self.leaf] = val
+
+    def delete(self,obj,keyErrorAsNone=False):
+        obj = self.parent(obj,keyErrorAsNone)
+        if obj is not None:
+            obj.pop(self.leaf,None)
+
+    def exists(self,obj):
+        try:
+            return self.get(obj) != None
+        except KeyError:
+            return False
+
+# Compiled paths by path. Services are given a handful of paths, so this
+# is only cleared if it grows unreasonably
+COMPILED_PATHS = {}
+COMPILED_PATHS_MAX = 10000
+
+def compile_path(path):
+    """
+    Returns the (cached) CompiledPath for path
+    """
+    compiled = COMPILED_PATHS.get(path)
+    if compiled is None:
+        if len(COMPILED_PATHS) >= COMPILED_PATHS_MAX:
+            COMPILED_PATHS.clear()
+        compiled = COMPILED_PATHS[path] = CompiledPath(path)
+    return compiled
+
+# In select paths, stands for each element of a list (or the value itself if
+# it isn't a list)
+WILDCARD = '*'
+
+class Ref(object):
+    """
+    Where select found a value: the dict (or list) holding it and its key
+    (or index), so the value can be replaced or removed in place
+    """
+    __slots__ = ('container','key')
+
+    def __init__(self,container,key):
+        self.container = container
+        self.key = key
+
+    def get(self):
+        return self.container[self.key]
+
+    def set(self,val):
+        self.container[self.key] = val
+
+    def delete(self):
+        del self.container[self.key]
+
+class PathTree(object):
+    """
+    Several paths merged on their common prefixes, so that select_many
+    walks each part of an object once however many paths go through it
+    """
+    __slots__ = ('children','ends')
+
+    def __init__(self,paths=()):
+        self.children = {}
+        self.ends = []
+        for path in paths:
+            node = self
+            compiled = compile_path(path)
+            for key in compiled.parents + (compiled.leaf,):
+                node = node.children.setdefault(key,PathTree())
+            node.ends.append(path)
+
+    def walk(self,ref,refs):
+        for key, child in self.children.iteritems():
+            for found in step(ref,key):
+                for path in child.ends:
+                    refs[path].append(found)
+                if child.children:
+                    child.walk(found,refs)
+
+def step(ref,key):
+    """
+    Yields a Ref for each place key leads to from the value at ref. Keys go
+    through lists to the dicts in them, and WILDCARD to each element of a
+    list. A value that isn't a list stands for a list of itself
+    """
+    value = ref.get()
+    if key == WILDCARD:
+        if isinstance(value,list):
+            for i in xrange(len(value)):
+                yield Ref(value,i)
+        elif value is not None:
+            yield ref
+    elif isinstance(value,dict):
+        if key in value:
+            yield Ref(value,key)
+    elif isinstance(value,list):
+        for el in value:
+            if isinstance(el,dict) and key in el:
+                yield Ref(el,key)
 
-    pp,pn = tuple(path.lstrip(PATH_DELIM).split(PATH_DELIM,1))
-    if pp not in obj:
-        if not keyErrorAsNone:
-            raise KeyError('Path not found in object: %s (%s)'%(path,pp))
-        else:
-            return None
+PATH_TREES = {}
 
-    return getprop(obj[pp],pn,keyErrorAsNone)
+def select_many(obj,paths):
+    """
+    Returns {path: [Ref, ...]} with references to everything each of paths
+    selects in obj, in a single traversal of obj. Unlike getprop, paths go
+    through lists, to every dict in them, and WILDCARD selects each element
+    of a list. Paths that select nothing get no references
+    """
+    paths = tuple(paths)
+    tree = PATH_TREES.get(paths)
+    if tree is None:
+        if len(PATH_TREES) >= COMPILED_PATHS_MAX:
+            PATH_TREES.clear()
+        tree = PATH_TREES[paths] = PathTree(paths)
+    refs = dict((path,[]) for path in paths)
+    tree.walk(Ref([obj],0),refs)
+    return refs
+
+def select(obj,path):
+    """
+    Returns references to everything path selects in obj, see select_many
+    """
+    return select_many(obj,(path,))[path]
+
+def getprop(obj,path,keyErrorAsNone=False):
+    """
+    Returns the value of the key identified by interpreting
+    the path as a delimited hierarchy of keys
+    """
+    return compile_path(path).get(obj,keyErrorAsNone)
 
 def setprop(obj,path,val,keyErrorAsNone=False):
     """
     Sets the value of the key identified by interpreting
     the path as a delimited hierarchy of keys
     """
-    if '/' not in path:
-        obj[path] = val
-        return
-
-    pp,pn = tuple(path.lstrip(PATH_DELIM).split(PATH_DELIM,1))
-    if pp not in obj:
-        if not keyErrorAsNone:
-            raise KeyError('Path not found in object: %s (%s)'%(path,pp))
-        else:
-            return None
-
-    return setprop(obj[pp],pn,val,keyErrorAsNone)
+    compile_path(path).set(obj,val,keyErrorAsNone)
 
 def delprop(obj,path,keyErrorAsNone=False):
     """
     Removes the key-value from obj
     """
-    if '/' not in path:
-        obj.pop(path,None)
-        return
-
-    pp,pn = tuple(path.lstrip(PATH_DELIM).split(PATH_DELIM,1))
-    if pp not in obj:
-        if not keyErrorAsNone:
-            raise KeyError('Path not found in object: %s (%s)'%(path,pp))
-        else:
-            return None
+    compile_path(path).delete(obj,keyErrorAsNone)
 
-    return delprop(obj[pp],pn,keyErrorAsNone=False)
+def getprop_or_default(obj,path,default=None):
+    """
+    Returns the value of the key path in the object, or default if it
+    doesn't exist
+    """
+    return compile_path(path).get_or_default(obj,default)
 
 def exists(obj,path):
     """
     Returns True if the key path exists in the object
     """
-    found = False
-    try:
-        found = getprop(obj,path,keyErrorAsNone=False) != None
-    except KeyError:
-        pass
-
-    return found
+    return compile_path(path).exists(obj)
 
 TEST_OBJ = {
     'person': {
@@ -102,3 +238,81 @@ def test_set_dict():
     o = copy.deepcopy(TEST_OBJ)
     setprop(o,'person',{'name': 'jason jones','age': 38})
     assert getprop(o,PATH_DELIM.join(('person','age'))) == 38
+
+def test_delete():
+    o = copy.deepcopy(TEST_OBJ)
+    delprop(o,PATH_DELIM.join(('person','age')))
+    assert not exists(o,PATH_DELIM.join(('person','age')))
+    delprop(o,PATH_DELIM.join(('person','age')))
+    try:
+        delprop(o,PATH_DELIM.join(('nobody','age')))
+        assert False
+    except KeyError:
+        pass
+    delprop(o,PATH_DELIM.join(('nobody','age')),keyErrorAsNone=True)
+
+def test_missing():
+    assert getprop(TEST_OBJ,PATH_DELIM.join(('person','sex')),keyErrorAsNone=True) is None
+    assert getprop(TEST_OBJ,PATH_DELIM.join(('nobody','name')),keyErrorAsNone=True) is None
+    for path in (PATH_DELIM.join(('person','sex')), PATH_DELIM.join(('nobody','name'))):
+        try:
+            getprop(TEST_OBJ,path)
+            assert False
+        except KeyError:
+            pass
+
+def test_compiled_path():
+    path = compile_path(PATH_DELIM.join(('','person','name')))
+    assert path is compile_path(PATH_DELIM.join(('','person','name')))
+    assert path.parents == ('person',) and path.leaf == 'name'
+    assert path.get(TEST_OBJ) == TEST_OBJ['person']['name']
+    assert path.exists(TEST_OBJ)
+
+    o = copy.deepcopy(TEST_OBJ)
+    path.set(o,'jason jones')
+    assert o['person']['name'] == 'jason jones'
+    path.delete(o)
+    assert not path.exists(o)
+    assert path.get_or_default(o,'nobody') == 'nobody'
+    assert compile_path('nobody/name').get_or_default(o) is None
+    o['person']['name'] = None
+    assert path.get_or_default(o,'nobody') == 'nobody'
+    assert getprop_or_default(TEST_OBJ,'address/city') == 'ottawa'
+    assert getprop_or_default(TEST_OBJ,'address/zip',[]) == []
+
+SELECT_OBJ = {
+    'aggregatedCHO': {
+        'spatial': [
+            {'name': 'Ottawa', 'state': 'Ontario'},
+            {'name': 'Toronto'},
+            'nowhere'
+        ],
+        'subject': {'name': 'maps'}
+    }
+}
+def test_select():
+    names = [ ref.get() for ref in select(SELECT_OBJ,'aggregatedCHO/spatial/name') ]
+    assert names == ['Ottawa', 'Toronto']
+    names = [ ref.get() for ref in select(SELECT_OBJ,'aggregatedCHO/spatial/*/name') ]
+    assert names == ['Ottawa', 'Toronto']
+    assert len(select(SELECT_OBJ,'aggregatedCHO/spatial/*')) == 3
+    assert [ ref.get() for ref in select(SELECT_OBJ,'aggregatedCHO/subject/*/name') ] == ['maps']
+    assert select(SELECT_OBJ,'aggregatedCHO/temporal/*/name') == []
+    assert select(SELECT_OBJ,'nothing') == []
+
+def test_select_many():
+    paths = ('aggregatedCHO/spatial/*/name','aggregatedCHO/spatial/*/state','aggregatedCHO/subject')
+    refs = select_many(SELECT_OBJ,paths)
+    assert [ ref.get() for ref in refs[paths[0]] ] == ['Ottawa', 'Toronto']
+    assert [ ref.get() for ref in refs[paths[1]] ] == ['Ontario']
+    assert [ ref.get() for ref in refs[paths[2]] ] == [{'name': 'maps'}]
+
+def test_select_in_place():
+    o = copy.deepcopy(SELECT_OBJ)
+    for ref in select(o,'aggregatedCHO/spatial/*/name'):
+        ref.set(ref.get().upper())
+    select(o,'aggregatedCHO/spatial/*/state')[0].delete()
+    assert o['aggregatedCHO']['spatial'][:2] == [{'name': 'OTTAWA'}, {'name': 'TORONTO'}]
+    # A lone value is replaced where it is
+    select(o,'aggregatedCHO/subject/*')[0].set([{'name': 'charts'}])
+    assert o['aggregatedCHO']['subject'] == [{'name': 'charts'}]
@@ -3,7 +3,8 @@
 #
 # Usage: python poll_images.py <profiles-glob> <enrichment-service-URI.
 
-from amara.thirdparty import json, httplib2
+from amara.thirdparty import httplib2
+from dplaingestion import jsonio as json
 from amara.lib.iri import join
 import logging
 import logging.handlers
@@ -0,0 +1,29 @@
+"""Loads Akara modules into the test process, for testing their parts"""
+import imp, os, sys
+import akara
+import dplaingestion.akamod
+
+class EnrichConfig:
+    couch_database = 'http://couch.example.org/dpla'
+    couch_database_username = 'test'
+    couch_database_password = 'test'
+
+MODULE_NAME = 'enrich_module.enrich'
+
+def load_akamod(filename, module_name):
+    """
+    Loads lib/akamod/<filename> as module_name, once. Hyphenated modules
+    can't be imported by name
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    if akara.raw_config is None:
+        akara.raw_config = {}
+    path = os.path.join(os.path.dirname(dplaingestion.akamod.__file__), filename)
+    return imp.load_source(module_name, path)
+
+def load_enrich():
+    if akara.raw_config is None:
+        akara.raw_config = {}
+    akara.raw_config['enrich'] = EnrichConfig
+    return load_akamod('enrich.py', MODULE_NAME)
@@ -128,6 +128,16 @@ class download_preview:
         'image/png'  : '.png',
     }
 
+class enrich:
+    couch_database_username = 'test'
+    couch_database_password = 'test'
+    # Small enough to split test documents across workers
+    batch_size = 2
+    max_workers = 2
+    server_timing = 1
+    stats_interval = 0
+    profile_dir = Akara.ConfigRoot+'/profiles'
+
 class lookup:
     lookup_mapping = {
         'test': 'test_subst',
@@ -298,3 +308,10 @@ def get_thumbs_root():
     This function solves the problem.
     """
     return thumbs_root
+
+def read_access_log():
+    """
+    Returns the lines of the Akara's access log, one per request served.
+    """
+    with open(os.path.join(config_root, 'logs', 'access.log'), "r") as logfile:
+        return logfile.readlines()
@@ -0,0 +1,133 @@
+import tempfile
+from cStringIO import StringIO
+from amara.thirdparty import json
+from enrich_module import load_enrich
+
+ENRICH = load_enrich()
+
+class Response(dict):
+    def __init__(self, status):
+        dict.__init__(self, status=str(status))
+        self.status = status
+
+class FakeCouch(object):
+    """
+    Stands in for enrich.H, answering each request with the next of the
+    (status, content) responses given and keeping (path, body) of each
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, uri, method, body=None, headers=None):
+        self.requests.append((uri.rsplit('/', 1)[-1], json.loads(body)))
+        status, content = self.responses.pop(0)
+        return Response(status), json.dumps(content)
+
+    def bulk_requests(self):
+        return [body["docs"] for path, body in self.requests if path == "_bulk_docs"]
+
+def write(couch, docs, **kwargs):
+    real_h, ENRICH.H = ENRICH.H, couch
+    try:
+        writer = ENRICH.CouchBulkWriter(kwargs.pop("src", "test"), **kwargs)
+        for doc in docs:
+            writer.add(doc)
+        writer.flush()
+    finally:
+        ENRICH.H = real_h
+    assert couch.responses == []
+    return writer
+
+def test_bulk_writer_retries_conflicts():
+    "Conflicted docs are resent with their current revision"
+    couch = FakeCouch(
+        (200, {"rows": [{"key": "a", "error": "not_found"},
+                        {"key": "b", "id": "b", "value": {"rev": "1-x"}}]}),
+        (201, [{"id": "a", "rev": "1-a"}, {"id": "b", "error": "conflict"}]),
+        (200, {"rows": [{"key": "b", "id": "b", "value": {"rev": "2-y"}}]}),
+        (201, [{"id": "b", "rev": "3-b"}])
+    )
+    writer = write(couch, [{"_id": "a", "n": 1}, {"_id": "b", "n": 2}], src="conflicts")
+    assert writer.written == ["a", "b"]
+    assert writer.failed == []
+    first, retry = couch.bulk_requests()
+    assert first == [{"_id": "a", "n": 1}, {"_id": "b", "_rev": "1-x", "n": 2}]
+    assert retry == [{"_id": "b", "_rev": "2-y", "n": 2}]
+    assert ENRICH.REV_CACHE.get(("conflicts", "a")) == "1-a"
+    assert ENRICH.REV_CACHE.get(("conflicts", "b")) == "3-b"
+
+def test_bulk_writer_drops_revs_of_deleted_docs():
+    "A conflicted doc deleted since its rev was cached is written without a rev"
+    ENRICH.REV_CACHE.put(("deleted", "a"), "1-a")
+    couch = FakeCouch(
+        (201, [{"id": "a", "error": "conflict"}]),
+        (200, {"rows": [{"key": "a", "id": "a", "value": {"rev": "2-a", "deleted": True}}]}),
+        (201, [{"id": "a", "rev": "3-a"}])
+    )
+    writer = write(couch, [{"_id": "a"}], src="deleted")
+    assert writer.written == ["a"]
+    assert couch.bulk_requests() == [[{"_id": "a", "_rev": "1-a"}], [{"_id": "a"}]]
+    assert ENRICH.REV_CACHE.get(("deleted", "a")) == "3-a"
+
+def test_bulk_writer_resends_failed_chunks():
+    "A chunk whose request fails is sent again as a whole"
+    docs = [{"_id": "a"}, {"_id": "b"}, {"_id": "c"}]
+    couch = FakeCouch(
+        (503, {"error": "unavailable"}),
+        (201, [{"id": "a", "rev": "1-a"}, {"id": "b", "rev": "1-b"}]),
+        (201, [{"id": "c", "rev": "1-c"}])
+    )
+    writer = write(couch, docs, src="resends", check_revs=False, max_docs=2)
+    assert writer.written == ["a", "b", "c"]
+    assert couch.bulk_requests() == [docs[:2], docs[:2], docs[2:]]
+
+def test_bulk_writer_gives_up():
+    "Docs still conflicting after max_retries resends are given up on"
+    couch = FakeCouch(*[
+        response for attempt in range(3) for response in (
+            (201, [{"id": "a", "error": "conflict"}, {"id": "b", "error": "forbidden"}] if attempt == 0
+                  else [{"id": "a", "error": "conflict"}]),
+            (200, {"rows": [{"key": "a", "id": "a", "value": {"rev": "%d-a" % (attempt + 2)}}]}))
+    ])
+    writer = write(couch, [{"_id": "a", "_rev": "1-a"}, {"_id": "b"}], src="gives-up",
+                   check_revs=False, max_retries=2)
+    assert writer.written == []
+    assert sorted(writer.failed) == ["a", "b"]
+    assert [docs[0]["_rev"] for docs in couch.bulk_requests()] == ["1-a", "2-a", "3-a"]
+
+def call_enrich(couch, items, **headers):
+    body = json.dumps({"items": items})
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "QUERY_STRING": "",
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": StringIO(body),
+        "HTTP_SOURCE": "test",
+        "HTTP_COLLECTION": "coll",
+        "HTTP_INGEST_MODE": "initial"
+    }
+    environ.update(("HTTP_" + k.upper().replace("-", "_"), v) for k, v in headers.items())
+    real_h, ENRICH.H = ENRICH.H, couch
+    saved_dir, ENRICH.STATS_DIR = ENRICH.STATS_DIR, tempfile.mkdtemp()
+    try:
+        content = "".join(ENRICH.enrich(environ, lambda status, headers: None))
+    finally:
+        ENRICH.H = real_h
+        ENRICH.STATS_DIR = saved_dir
+    assert couch.responses == []
+    return json.loads(content)
+
+def test_enrich_returns_stored_ids_on_request():
+    "Stored docs are returned unless a Return-Docs: 0 header asks for their ids"
+    responses = lambda: ((201, {"ok": True}), (201, [{"id": "test--1", "rev": "1-a"}]))
+    docs = call_enrich(FakeCouch(*responses()), [{"id": "1", "_id": "test--1"}])["docs"]
+    assert [doc["_id"] for doc in docs] == ["test--1"]
+    assert call_enrich(FakeCouch(*responses()), [{"id": "1", "_id": "test--1"}], **{"Return-Docs": "0"}) == \
+        {"stored": ["test--1"], "failed": []}
+
+def test_with_rev():
+    assert json.loads(ENRICH.with_rev('{"_id": "a"}', "1-a")) == {"_id": "a", "_rev": "1-a"}
+    assert json.loads(ENRICH.with_rev('{"_id": "a", "_rev": "1-a"}', "2-a")) == {"_id": "a", "_rev": "2-a"}
+    assert json.loads(ENRICH.with_rev('{"_id": "a", "_rev": "1-a"}', None)) == {"_id": "a"}
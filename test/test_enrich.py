@@ -1,5 +1,5 @@
 import sys
-from server_support import server, print_error_log, H
+from server_support import server, print_error_log, read_access_log, H
 
 import os
 from amara.thirdparty import json
@@ -277,5 +277,210 @@ def test_physical_format_from_format_and_type():
     result = json.loads(content)
     assert result['TBD_physicalformat'] == EXPECTED['TBD_physicalformat']
 
+def test_shred_batch():
+    "Shredding a batch of records in one request"
+    INPUT = {
+        "items": [
+            {"id": "1", "prop1": "lets;go"},
+            {"id": "2", "prop1": "bluejays"}
+        ]
+    }
+    EXPECTED = {
+        "items": [
+            {"id": "1", "prop1": ["lets", "go"]},
+            {"id": "2", "prop1": "bluejays"}
+        ]
+    }
+    headers = dict(H.HEADERS)
+    headers["Pipeline-Batch"] = "true"
+    resp, content = H.request(server() + "shred?prop=prop1", "POST", body=json.dumps(INPUT), headers=headers)
+    assert str(resp.status).startswith("2")
+    assert resp["pipeline-batch"] == "true"
+    assert json.loads(content) == EXPECTED
+
+def test_lookup_batch_keeps_rejected_items():
+    "Items a stage rejects are returned unchanged in a batch"
+    INPUT = {
+        "items": [
+            {"a": "aaa"},
+            {"a": "bbb"}
+        ]
+    }
+    headers = dict(H.HEADERS)
+    headers["Pipeline-Batch"] = "true"
+    url = server() + "lookup?prop=a&target=a&substitution=missing"
+    resp, content = H.request(url, "POST", body=json.dumps(INPUT), headers=headers)
+    assert str(resp.status).startswith("2")
+    assert json.loads(content) == INPUT
+
+def test_batch_prepare():
+    "A batch is handed to the service's prepare function before its items"
+    from cStringIO import StringIO
+    from dplaingestion.batch import batch_service
+    INPUT = {
+        "items": [
+            {"a": "aaa"},
+            {"a": "bbb"}
+        ]
+    }
+    prepared = []
+    def prepare(items, prop=None, **params):
+        prepared.append((items, prop))
+    def app(environ, start_response):
+        start_response("200 OK", [])
+        return [environ["wsgi.input"].read()]
+    body = json.dumps(INPUT)
+    environ = {
+        "HTTP_PIPELINE_BATCH": "true",
+        "QUERY_STRING": "prop=a&other=1",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": StringIO(body)
+    }
+    result = batch_service(app, prepare=prepare)(environ, lambda *args: None)
+    assert prepared == [(INPUT["items"], "a")]
+    assert json.loads("".join(result)) == INPUT
+
+def test_enrich_pipeline_inprocess():
+    """
+    Records run through local pipeline stages without loopback HTTP
+    """
+    INPUT = {
+        "items": [
+            {"id": "1", "subject": "a. b;c -- d."},
+            {"id": "2", "subject": "efg"}
+        ]
+    }
+    headers = dict(H.HEADERS)
+    headers.update({
+        "Source": "test",
+        "Collection": "coll",
+        "Pipeline-Rec": ",".join([server() + "shred?prop=subject",
+                                  server() + "enrich-subject?prop=subject"])
+    })
+
+    logged = len(read_access_log())
+    resp, content = H.request(server() + "enrich", "POST", body=json.dumps(INPUT), headers=headers)
+    assert str(resp.status).startswith("2")
+    requests = read_access_log()[logged:]
+    # The stages were called without any requests of their own
+    assert [line.split('"')[1] for line in requests] == ["POST /enrich HTTP/1.1"], requests
+    docs = json.loads(content)["docs"]
+    assert [d["subject"] for d in docs] == [[{"name": "A. b"}, {"name": "C--d"}], [{"name": "Efg"}]]
+    assert docs[0]["originalRecord"]["subject"] == "a. b;c -- d."
+    assert docs[1]["collection"]["name"] == "coll"
+
+def test_enrich_passes_original_record_to_its_readers():
+    """
+    originalRecord is kept out of the stages except those declared to read it
+    """
+    INPUT = {
+        "items": [
+            {"id": "1", "handle": ["aaa", "http://repository.clemson.edu/u?/scp,104"], "left": "r"},
+            {"id": "2", "handle": ["bbb", "http://repository.clemson.edu/u?/scp,105"], "left": "r"}
+        ]
+    }
+    headers = dict(H.HEADERS)
+    headers.update({
+        "Source": "test",
+        "Collection": "coll",
+        "Pipeline-Rec": ",".join([server() + "shred?prop=handle",
+                                  server() + "contentdm_identify_object?rights_field=left&download=False",
+                                  server() + "select-id?prop=id"])
+    })
+
+    resp, content = H.request(server() + "enrich", "POST", body=json.dumps(INPUT), headers=headers)
+    assert str(resp.status).startswith("2")
+    docs = json.loads(content)["docs"]
+    assert [d["object"]["@id"] for d in docs] == [
+        "http://repository.clemson.edu/cgi-bin/thumbnail.exe?CISOROOT=/scp&CISOPTR=104",
+        "http://repository.clemson.edu/cgi-bin/thumbnail.exe?CISOROOT=/scp&CISOPTR=105"
+    ]
+    assert [d["originalRecord"] for d in docs] == INPUT["items"]
+
+def test_enrich_server_timing():
+    """
+    enrich reports the time spent in each stage, in pipeline order
+    """
+    INPUT = {"items": [{"id": str(i), "subject": "s%d;t%d" % (i, i)} for i in range(3)]}
+    stages = [server() + "shred?prop=subject", server() + "enrich-subject?prop=subject"]
+    headers = dict(H.HEADERS)
+    headers.update({
+        "Source": "test",
+        "Collection": "coll",
+        "Pipeline-Rec": ",".join(stages)
+    })
+
+    resp, content = H.request(server() + "enrich", "POST", body=json.dumps(INPUT), headers=headers)
+    assert str(resp.status).startswith("2")
+    metrics = [m.strip().split(";") for m in resp["server-timing"].split(",")]
+    assert [m[0] for m in metrics] == ["stage1", "stage2"]
+    assert [m[2] for m in metrics] == ['desc="%s"' % uri for uri in stages]
+
+def test_enrich_stats():
+    "Stage timings from every server process are served by enrich-stats"
+    INPUT = {"items": [{"id": str(i), "subject": "s%d;t%d" % (i, i)} for i in range(3)]}
+    stage = server() + "shred?prop=subject"
+    headers = dict(H.HEADERS)
+    headers.update({
+        "Source": "stats-test",
+        "Collection": "coll",
+        "Pipeline-Rec": stage
+    })
+    for i in range(4):
+        resp, content = H.request(server() + "enrich", "POST", body=json.dumps(INPUT), headers=headers)
+        assert str(resp.status).startswith("2")
+
+    resp, content = H.request(server() + "enrich-stats?source=stats-test", "GET", body=None)
+    assert str(resp.status).startswith("2")
+    stats = json.loads(content)["stats-test"][stage]
+    # Batches of 2 (see server_support), so two calls per request
+    assert stats["calls"] == 8
+    assert stats["records"] == 12
+    assert stats["errors"] == 0
+    assert stats["bytes_in"] > 0 and stats["bytes_out"] > 0
+    assert stats["min"] <= stats["p50"] <= stats["p90"] <= stats["max"]
+
+def test_enrich_profile_pipeline():
+    "Stages of sampled records are profiled into a pstats file per stage"
+    import pstats, server_support
+    # A single batch, as workers don't call stages in-process
+    INPUT = {"items": [{"id": str(i), "subject": "s%d;t%d" % (i, i)} for i in range(2)]}
+    headers = dict(H.HEADERS)
+    headers.update({
+        "Source": "profile-test",
+        "Collection": "coll",
+        "Pipeline-Rec": server() + "shred?prop=subject",
+        "Profile-Pipeline": "1"
+    })
+    resp, content = H.request(server() + "enrich", "POST", body=json.dumps(INPUT), headers=headers)
+    assert str(resp.status).startswith("2")
+    path = os.path.join(server_support.config_root, "profiles", "profile-test", "coll",
+                        "shred%3Fprop%3Dsubject.pstats")
+    assert os.path.exists(path), path
+    stats = pstats.Stats(path)
+    assert any(func[2] == "shred" for func in stats.stats)
+
+def test_enrich_keeps_record_order():
+    """
+    Records enriched by concurrent workers come back in input order
+    """
+    INPUT = {"items": [{"id": str(i), "subject": "s%d;t%d" % (i, i)} for i in range(7)]}
+    headers = dict(H.HEADERS)
+    headers.update({
+        "Source": "test",
+        "Collection": "coll",
+        "Pipeline-Rec": server() + "shred?prop=subject"
+    })
+
+    logged = len(read_access_log())
+    resp, content = H.request(server() + "enrich", "POST", body=json.dumps(INPUT), headers=headers)
+    assert str(resp.status).startswith("2")
+    # The workers called the stage over HTTP, a batch at a time
+    requests = [line.split('"')[1] for line in read_access_log()[logged:]]
+    assert requests.count("POST /shred?prop=subject HTTP/1.1") == 4, requests
+    docs = json.loads(content)["docs"]
+    assert [d["id"] for d in docs] == [str(i) for i in range(7)]
+    assert [d["subject"] for d in docs] == [["s%d" % i, "t%d" % i] for i in range(7)]
+
 if __name__ == "__main__":
     raise SystemExit("Use nosetests")
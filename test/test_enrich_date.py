@@ -3,6 +3,7 @@ from nose.tools import nottest
 
 from server_support import server, H
 from dict_differ import DictDiffer
+from enrich_module import load_akamod
 
 
 def test_enrich_dates_bogus_date():
@@ -343,5 +344,34 @@ def test_enrich_temporal_date():
     REAL = json.loads(content)
     assert REAL == EXPECTED, DictDiffer(REAL, EXPECTED).diff()
 
+def load_enrich_date():
+    # Needs zen, like the service itself
+    return load_akamod("enrich-date.py", "enrich_module.enrich_date")
+
+def test_fast_date():
+    "Plain dates are recognized up front, the same as the fuzzy parsers read them"
+    module = load_enrich_date()
+    for d in ("1928", "1406", "1928-05-20", "1905-04-12", "05/20/1928", "5/7/2012",
+              "01/01/1901", "12/31/1999", "2012-02-31", "2/30/2012", "13/1/2012",
+              "0999", "May 20, 1928", "c. 1928", "1999.11.01", "12-19-2010",
+              "1901 / 01 / 01", "could be 1928ish?", "n.d."):
+        fast = module.fast_date(d)
+        if fast is not None:
+            assert fast == module.fuzzy_date_parser(d), d
+    assert module.fast_date("1928") == "1928"
+    assert module.fast_date("05/20/1928") == "1928-05-20"
+    for d in ("2012-02-31", "13/1/2012", "0999", "1928-5-20", "c. 1928"):
+        assert module.fast_date(d) is None, d
+    assert module.parse_uncached("1960-1970") == ("1960", "1970")
+
+def test_parse_date_or_range_cached():
+    "Cached parses are the same as fresh ones"
+    module = load_enrich_date()
+    for d in ("ca. July 1896", "c. 1890-95", "5/7/2012", " 1999   -   2004  "):
+        parsed = module.parse_uncached(d.strip())
+        assert module.parse_date_or_range(d) == parsed
+        assert module.parse_date_or_range(d) == parsed
+        assert d.strip() in module.PARSE_CACHE
+
 if __name__ == "__main__":
     raise SystemExit("Use nosetests")
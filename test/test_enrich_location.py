@@ -81,6 +81,27 @@ def test_from_abbrev7():
     OUTPUT = from_abbrev(INPUT)
     assert OUTPUT == EXPECTED
 
+def test_from_abbrev8():
+    """
+    Should check every abbreviation listed for a State, not just the first.
+    """
+    INPUT = "State College, Penn."
+    EXPECTED = ["Pennsylvania"]
+
+    OUTPUT = from_abbrev(INPUT)
+    assert OUTPUT == EXPECTED
+
+def test_from_abbrev9():
+    """
+    Should keep States named in full alongside an abbreviated one.
+    """
+    INPUT = "WEST VIRGINIA, PENN, ARKANSAS"
+    EXPECTED = ("US-KS;US-VA;US-AR;US-WV;US-PA",
+                "Kansas;Virginia;Arkansas;West Virginia;Pennsylvania")
+
+    OUTPUT = get_isostate(INPUT, frm_abbrev="Yes")
+    assert OUTPUT == EXPECTED
+
 # BEGIN get_isostate tests
 def test_get_isostate_non_string_param_fail():
     """
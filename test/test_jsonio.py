@@ -0,0 +1,46 @@
+import json as stdlib_json
+from dplaingestion.jsonio import loads, dumps
+
+# Records like the ones going through the pipeline
+SAMPLE_RECORDS = [
+    {u'id': u'8a1f2c0e9b7d4e3a', u'_id': u'artstor--SS7731421_7731421_8410284',
+     u'ingestType': u'item', u'ingestDate': u'2013-01-15T12:00:00.000000',
+     u'sourceResource': {
+         u'title': [u'Vue de la ville de Qu\xe9bec', u'\u6771\u4eac'],
+         u'creator': u'Smith, John \u2014 "the elder"',
+         u'subject': [{u'name': u'Maps'}, {u'name': u'Qu\xe9bec (Province)'}],
+         u'date': {u'begin': u'1850-01-01', u'end': u'1859-12-31',
+                   u'displayDate': u'1850s'},
+         u'spatial': [{u'name': u'Qu\xe9bec', u'coordinates': u'46.81, -71.21'}],
+         u'description': u'Line one\nline two\ttabbed \\ backslashed </script>',
+         u'rights': None, u'extent': [], u'format': {}},
+     u'originalRecord': {u'handle': [u'http://example.org/1', u'SS7731421'],
+                         u'width': 1024, u'height': 768, u'ratio': 1.3333333333333333,
+                         u'score': -0.1, u'large': 12345678901234567890,
+                         u'public': True, u'deleted': False}},
+    {u'items': [{u'a': 1e-7}, {u'b': 3.0}, {u'c': [u'\x00\x1f\x7f\ud800']}]},
+    [u'', 0, -1, 1.5e300, u'\U0001f600', {u'nested': {u'deeper': [[[]]]}}],
+]
+
+def test_loads_matches_stdlib():
+    for record in SAMPLE_RECORDS:
+        for text in (stdlib_json.dumps(record), stdlib_json.dumps(record, ensure_ascii=False).encode('utf-8')):
+            assert loads(text) == stdlib_json.loads(text)
+            assert stdlib_json.dumps(loads(text)) == stdlib_json.dumps(stdlib_json.loads(text))
+
+def test_dumps_matches_stdlib():
+    for record in SAMPLE_RECORDS:
+        assert dumps(record) == stdlib_json.dumps(record)
+        assert dumps(record, sort_keys=True) == stdlib_json.dumps(record, sort_keys=True)
+        assert dumps(record, indent=4) == stdlib_json.dumps(record, indent=4)
+        # As decoded by each
+        assert dumps(loads(dumps(record))) == stdlib_json.dumps(stdlib_json.loads(stdlib_json.dumps(record)))
+
+def test_loads_rejects_what_stdlib_rejects():
+    for text in ('', '{', '{"a": 1,}', "{'a': 1}", '[1] x'):
+        try:
+            loads(text)
+        except ValueError:
+            pass
+        else:
+            assert False, text
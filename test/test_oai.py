@@ -0,0 +1,90 @@
+from dplaingestion.oai import oaiservice
+from amara.thirdparty import json
+from nose.tools import assert_equals
+
+PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2011-03-14T21:29:34Z</responseDate>
+  <request verb="ListRecords" set="s1" metadataPrefix="oai_dc">http://example.org/oai</request>
+  <ListRecords>
+    <record>
+      <header>
+        <identifier>oai:example.org:1</identifier>
+        <datestamp>2008-03-10T16:34:16Z</datestamp>
+        <setSpec>s1</setSpec>
+      </header>
+      <metadata>
+        <oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/">
+          <dc:title>A &amp; B</dc:title>
+          <dc:date>2005-09-15</dc:date>
+          <dc:date>1978</dc:date>
+          <dc:identifier>04980676</dc:identifier>
+          <dc:extent>2 pages</dc:extent>
+        </oai_dc:dc>
+      </metadata>
+    </record>
+    <record>
+      <header status="deleted">
+        <identifier>oai:example.org:2</identifier>
+        <datestamp>2009-01-01T00:00:00Z</datestamp>
+      </header>
+    </record>
+    <resumptionToken>s1/oai_dc/100</resumptionToken>
+  </ListRecords>
+</OAI-PMH>
+"""
+
+def _list_records(page, **kwargs):
+    remote = oaiservice("http://example.org/oai")
+    urls = []
+    def request(url):
+        urls.append(url)
+        return {'status': '200'}, page
+    remote.h.request = request
+    result = remote.list_records(set="s1", **kwargs)
+    return urls, result
+
+def test_list_records():
+    """list_records should build records from the page it fetched"""
+    urls, result = _list_records(PAGE)
+    assert_equals(len(urls), 1)
+    assert_equals(result['resumption_token'], u"s1/oai_dc/100")
+    assert_equals(json.loads(json.dumps(result['records'])), [
+        [u"oai:example.org:1", {
+            u"datestamp": [u"2008-03-10T16:34:16Z"],
+            u"title": [u"A & B"],
+            u"date": [u"2005-09-15", u"1978"],
+            u"handle": [u"04980676"]
+        }]
+    ])
+    assert_equals(result['deleted'], [u"oai:example.org:2"])
+
+def test_list_records_last_page():
+    """list_records should return an empty token on the last page"""
+    urls, result = _list_records(PAGE.replace("<resumptionToken>s1/oai_dc/100</resumptionToken>", "<resumptionToken/>"))
+    assert_equals(result['resumption_token'], u"")
+    urls, result = _list_records(PAGE.replace("<resumptionToken>s1/oai_dc/100</resumptionToken>", ""))
+    assert_equals(result['resumption_token'], u"")
+
+def test_list_records_window():
+    """list_records should ask for the changes between from and until"""
+    urls, result = _list_records(PAGE, from_date="2012-10-01", until_date="2012-10-31")
+    assert "from=2012-10-01" in urls[0]
+    assert "until=2012-10-31" in urls[0]
+    urls, result = _list_records(PAGE)
+    assert "from=" not in urls[0]
+
+def test_iter_records():
+    """iter_records should follow resumption tokens across pages"""
+    remote = oaiservice("http://example.org/oai")
+    last = PAGE.replace("<resumptionToken>s1/oai_dc/100</resumptionToken>", "<resumptionToken/>")
+    last = last.replace("oai:example.org:", "oai:example.org:p2-")
+    urls = []
+    def request(url):
+        urls.append(url)
+        return {'status': '200'}, (last if len(urls) > 1 else PAGE)
+    remote.h.request = request
+    ids = [ id_ for id_, props in remote.iter_records("s1") ]
+    assert_equals(ids, [u"oai:example.org:1", u"oai:example.org:p2-1"])
+    assert_equals(len(urls), 2)
+    assert "resumptionToken=s1%2Foai_dc%2F100" in urls[1]
@@ -0,0 +1,53 @@
+from amara.thirdparty import json
+
+def load_oai_set_name():
+    import imp, os
+    import akara
+    import dplaingestion.akamod
+    if akara.raw_config is None:
+        akara.raw_config = {}
+    path = os.path.join(os.path.dirname(dplaingestion.akamod.__file__), 'oai-set-name.py')
+    return imp.load_source('dplaingestion.akamod.oai-set-name', path)
+
+def sets_store(clock, max_age=3600):
+    import os, tempfile
+    from dplaingestion.cache import SQLiteCache
+    return SQLiteCache(os.path.join(tempfile.mkdtemp(), 'oai-sets.sqlite3'), max_age, clock=clock)
+
+ENDPOINT = "http://example.org/oai"
+SETS_SERVICE = "http://localhost:8879/oai.listsets.json?endpoint=" + ENDPOINT
+
+def test_sets_key():
+    "Listings are stored by the OAI endpoint of the sets service"
+    module = load_oai_set_name()
+    assert module.sets_key(SETS_SERVICE) == ENDPOINT
+    assert module.sets_key("http://example.org/sets") == "http://example.org/sets"
+
+def test_list_sets_stored():
+    "A listing stored by dpla-list-sets is read without fetching the sets service"
+    module = load_oai_set_name()
+    now = [1000.0]
+    store = sets_store(lambda: now[0])
+    store.put_many([(ENDPOINT, [{"setSpec": "a", "setName": "Set A", "setDescription": "The first set"}])])
+    fetched = []
+    def fetch(sets_service):
+        fetched.append(sets_service)
+        return json.dumps([{"setSpec": "a", "setName": "Set A, renamed"}])
+
+    now[0] += 3599
+    assert module.list_sets(SETS_SERVICE, store, fetch)[0]["setName"] == "Set A"
+    assert fetched == []
+
+    # Too old to be used, so the sets service is asked again
+    now[0] += 2
+    assert module.list_sets(SETS_SERVICE, store, fetch)[0]["setName"] == "Set A, renamed"
+    assert fetched == [SETS_SERVICE]
+
+def test_list_sets_bad_listing():
+    module = load_oai_set_name()
+    try:
+        module.list_sets(SETS_SERVICE, None, lambda sets_service: "<html/>")
+    except ValueError:
+        pass
+    else:
+        assert False, "ValueError not raised"
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import tempfile
+from amara.thirdparty import json
+from enrich_module import load_enrich
+
+ENRICH = load_enrich()
+
+def stats_of(*latencies):
+    stats = ENRICH.StageStats()
+    for elapsed in latencies:
+        stats.add(elapsed, 1, 10, 10, True)
+    return stats
+
+def near(value, expected):
+    return expected <= value <= expected * ENRICH.LATENCY_GROWTH
+
+def test_stage_stats_percentiles_merge():
+    "Percentiles are of the calls of every process, whatever order they're merged in"
+    fast = stats_of(*[0.001] * 90)
+    slow = stats_of(*[1.0] * 10)
+    for first, second in ((fast, slow), (slow, fast)):
+        # By way of JSON, as saved
+        merged = ENRICH.StageStats(json.loads(json.dumps(first.state())))
+        merged.merge(json.loads(json.dumps(second.state())))
+        summary = merged.summary()
+        assert summary["calls"] == 100
+        assert near(summary["p50"], 0.001), summary
+        assert near(summary["p90"], 1.0), summary
+        assert summary["p99"] == 1.0
+        assert summary["min"] == 0.001 and summary["max"] == 1.0
+
+def exited_pid():
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+def test_stage_stats_of_exited_processes_are_folded():
+    directory = tempfile.mkdtemp()
+    saved_dir, ENRICH.STATS_DIR = ENRICH.STATS_DIR, directory
+    try:
+        ENRICH.STAGE_STATS.clear()
+        dead = os.path.join(directory, "%d.json" % exited_pid())
+        open(dead, "w").write(json.dumps(ENRICH.stats_state({"src": {"stage": stats_of(0.5, 0.5)}})))
+        ENRICH.record_stage_call("src", "stage", 0.01, 1, 10, 10, True)
+        ENRICH.save_stage_stats(force=True)
+
+        assert not os.path.exists(dead)
+        assert sorted(n for n in os.listdir(directory) if n.endswith(".json")) == \
+            sorted([ENRICH.STATS_AGGREGATE, "%d.json" % os.getpid()])
+        stats = ENRICH.load_stage_stats()["src"]["stage"].summary()
+        assert stats["calls"] == 3
+        assert stats["min"] == 0.01 and stats["max"] == 0.5
+
+        # Saving again doesn't count the folded stats twice
+        ENRICH.save_stage_stats(force=True)
+        assert ENRICH.load_stage_stats()["src"]["stage"].calls == 3
+    finally:
+        ENRICH.STATS_DIR = saved_dir
+        ENRICH.STAGE_STATS.clear()